@@ -6,12 +6,67 @@ Requires a YOLOv8 ONNX model trained to detect body parts.
 Recommended model: https://civitai.com/models/1736285
 """
 
+import gc
 import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
 import numpy as np
-from PIL import Image, ImageFilter, ImageDraw
-from typing import List, Dict, Tuple, Optional
+from numpy.lib.recfunctions import structured_to_unstructured
+from PIL import Image, ImageDraw
+from typing import List, Dict, Tuple, Optional, Union
 import onnxruntime as ort
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+if njit is not None:
+    @njit(fastmath=True, cache=True)
+    def _nms_numba(x1, y1, x2, y2, areas, iou_threshold):
+        """Greedy NMS over score-sorted float32 boxes; returns the kept positions."""
+        n = x1.shape[0]
+        keep = np.empty(n, dtype=np.int32)
+        suppressed = np.zeros(n, dtype=np.bool_)
+        count = 0
+        for i in range(n):
+            if suppressed[i]:
+                continue
+            keep[count] = i
+            count += 1
+            for j in range(i + 1, n):
+                if suppressed[j]:
+                    continue
+                w = max(0.0, min(x2[i], x2[j]) - max(x1[i], x1[j]))
+                h = max(0.0, min(y2[i], y2[j]) - max(y1[i], y1[j]))
+                inter = w * h
+                if inter / (areas[i] + areas[j] - inter + 1e-6) > iou_threshold:
+                    suppressed[j] = True
+        return keep[:count]
+else:
+    _nms_numba = None
+
+
+# One row per detection; boxes are integer xyxy in original image pixels
+DETECTION_DTYPE = np.dtype([
+    ('class_id', 'i4'),
+    ('conf', 'f4'),
+    ('x1', 'i4'),
+    ('y1', 'i4'),
+    ('x2', 'i4'),
+    ('y2', 'i4'),
+])
+
+
+def detections_to_regions(detections: np.ndarray) -> np.ndarray:
+    """[N, 4] int32 xyxy view of a detections array, usable as Censor regions."""
+    return structured_to_unstructured(detections[['x1', 'y1', 'x2', 'y2']])
+
 
 class CensorDetector:
     """YOLOv8 ONNX detector for sensitive body parts."""
@@ -27,11 +82,29 @@ class CensorDetector:
         "pussy",    # 4
     ]
     
-    def __init__(self, model_path: str = None, classes: List[str] = None):
+    def __init__(
+        self,
+        model_path: str = None,
+        classes: List[str] = None,
+        aggressive_memory: bool = True,
+        batch_size: int = 1
+    ):
         self.model_path = model_path
         self.session = None
         self.classes = classes or self.DEFAULT_CLASSES
         self.input_size = (640, 640)  # Standard YOLOv8 input size
+        # Images per session.run; models exported with a fixed batch override this
+        self.batch_size = max(1, batch_size)
+        # Shrink the GPU memory arena after every run so one large batch doesn't
+        # pin peak memory for the rest of the process (costs some latency)
+        self.aggressive_memory = aggressive_memory
+        self.run_options = None
+        self.io_binding = None  # Set in load() when running on CUDA
+        self.input_ortvalue = None
+        self._pad_buf = None  # Reused preprocess buffers, see _allocate_buffers()
+        self._chw = None
+        self._batch_buf = None
+        self.uint8_input = False  # Whether the session takes uint8 NHWC input
         
     def load(self, model_path: str = None):
         """Load the ONNX model, converting from .pt if necessary."""
@@ -100,18 +173,124 @@ class CensorDetector:
             # Create ONNX Runtime session
             # Note: We assign to a temp variable first to ensure full success before setting self.session
             print(f"Initializing ONNX session for: {self.model_path}")
-            providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-            session = ort.InferenceSession(self.model_path, providers=providers)
+            available_providers = ort.get_available_providers()
+            # TensorRT builds an engine on first run; cache it (and its tactic
+            # timings) next to the model so later launches load it directly
+            trt_cache_dir = os.path.join(os.path.dirname(os.path.abspath(self.model_path)), "trt_cache")
+            providers = [
+                ('TensorrtExecutionProvider', {
+                    'trt_engine_cache_enable': True,
+                    'trt_engine_cache_path': trt_cache_dir,
+                    'trt_timing_cache_enable': True,
+                    'trt_timing_cache_path': trt_cache_dir,
+                    'trt_fp16_enable': True,
+                    'trt_max_workspace_size': 2 << 30,
+                }),
+                ('CUDAExecutionProvider', {
+                    'cudnn_conv_algo_search': 'DEFAULT',
+                    'do_copy_in_default_stream': True,
+                }),
+                'CPUExecutionProvider',
+            ]
+            providers = [p for p in providers if (p[0] if isinstance(p, tuple) else p) in available_providers]
+            use_cuda = 'CUDAExecutionProvider' in available_providers
+            use_trt = 'TensorrtExecutionProvider' in available_providers
+            if use_trt:
+                os.makedirs(trt_cache_dir, exist_ok=True)
+            
+            # Prefer the variant that takes raw uint8 NHWC pixels and normalizes in-graph
+            base_model_path = self._uint8_input_model(self.model_path) or self.model_path
+            self.uint8_input = base_model_path != self.model_path
+            
+            # Half-precision weights/activations on GPU (I/O types stay as-is);
+            # on CPU, use an INT8 build if quantize_int8() has produced one
+            if use_cuda:
+                base_model_path = self._fp16_model(base_model_path) or base_model_path
+            else:
+                int8_path = self._int8_model_path(base_model_path)
+                if self._is_cache_fresh(int8_path, base_model_path):
+                    print(f"Using INT8 model: {int8_path}")
+                    base_model_path = int8_path
+            
+            sess_options = ort.SessionOptions()
+            
+            # Keep the CPU side lean: the detector runs one image at a time from
+            # the UI, so a small pool, no idle spinning and no arena growth
+            # beat ORT's all-cores defaults
+            sess_options.intra_op_num_threads = min(4, os.cpu_count() or 1)
+            sess_options.inter_op_num_threads = 1
+            sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            sess_options.enable_cpu_mem_arena = False
+            sess_options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+            
+            # Dynamic exports name their free dims batch/height/width; pin them so
+            # the EP compiles kernels once instead of per input shape
+            target_w, target_h = self.input_size
+            sess_options.add_free_dimension_override_by_name('batch', self.batch_size)
+            sess_options.add_free_dimension_override_by_name('height', target_h)
+            sess_options.add_free_dimension_override_by_name('width', target_w)
+            
+            # Reuse the graph ORT optimized on a previous run; optimizing is the
+            # bulk of session init. Fused ops are device-specific, so cache per device.
+            # TensorRT-compiled nodes can't be serialized; its engine cache covers that case.
+            optimized_path = self._optimized_model_path(
+                base_model_path, 'cuda' if use_cuda else 'cpu', self.batch_size
+            )
+            if use_trt:
+                session_model_path = base_model_path
+                sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            elif self._is_cache_fresh(optimized_path, base_model_path):
+                print(f"Using cached optimized graph: {optimized_path}")
+                session_model_path = optimized_path
+                sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            else:
+                session_model_path = base_model_path
+                sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                sess_options.optimized_model_filepath = optimized_path
+            
+            session = ort.InferenceSession(session_model_path, sess_options=sess_options, providers=providers)
             
             # Get input details
             input_info = session.get_inputs()[0]
             self.input_name = input_info.name
             
-            # Update input size from model if available
+            # Update input size (and fixed batch size) from model if available
             if len(input_info.shape) == 4:
-                _, _, h, w = input_info.shape
+                if self.uint8_input:
+                    n, h, w, _ = input_info.shape
+                else:
+                    n, _, h, w = input_info.shape
                 if isinstance(h, int) and isinstance(w, int):
                     self.input_size = (w, h)
+                if isinstance(n, int) and n > 0:
+                    self.batch_size = n
+            
+            self.output_names = [o.name for o in session.get_outputs()]
+            self._allocate_buffers()
+            
+            # On CUDA, bind a persistent device input buffer so each run only
+            # updates it in place instead of ORT allocating and copying a new one
+            self.io_binding = None
+            self.input_ortvalue = None
+            self.run_options = None
+            if 'CUDAExecutionProvider' in session.get_providers():
+                if self.aggressive_memory:
+                    # Only arena-backed devices can be listed; the CPU arena is disabled
+                    self.run_options = ort.RunOptions()
+                    self.run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "gpu:0")
+                
+                target_w, target_h = self.input_size
+                if self.uint8_input:
+                    input_shape, input_type = [self.batch_size, target_h, target_w, 3], np.uint8
+                else:
+                    input_shape, input_type = [self.batch_size, 3, target_h, target_w], np.float32
+                self.input_ortvalue = ort.OrtValue.ortvalue_from_shape_and_type(
+                    input_shape, input_type, 'cuda', 0
+                )
+                self.io_binding = session.io_binding()
+                self.io_binding.bind_ortvalue_input(self.input_name, self.input_ortvalue)
+                for output_name in self.output_names:
+                    self.io_binding.bind_output(output_name, 'cuda')
             
             self.session = session
             print(f"Censor detector loaded: {os.path.basename(self.model_path)}")
@@ -133,39 +312,266 @@ class CensorDetector:
                 )
             raise e
         
-    def preprocess(self, image: Image.Image) -> Tuple[np.ndarray, Tuple[float, float], Tuple[int, int]]:
-        """Preprocess image for YOLOv8 inference."""
-        original_size = image.size  # (width, height)
+    @classmethod
+    def _uint8_input_model(cls, model_path: str) -> Optional[str]:
+        """Get (building if needed) a copy of the model that takes uint8 NHWC input.
+        
+        Prepends Cast -> Transpose -> Mul(1/255) so normalization runs inside the
+        graph (on the GPU when available) and the host sends a 4x smaller tensor.
+        Returns None if the variant can't be built, e.g. 'onnx' isn't installed.
+        """
+        u8_path = f"{os.path.splitext(model_path)[0]}.u8in.onnx"
+        if cls._is_cache_fresh(u8_path, model_path):
+            return u8_path
+        
+        try:
+            import onnx
+            from onnx import helper, TensorProto
+        except ImportError:
+            return None
+        
+        try:
+            model = onnx.load(model_path)
+            graph = model.graph
+            initializer_names = {init.name for init in graph.initializer}
+            inputs = [i for i in graph.input if i.name not in initializer_names]
+            if len(inputs) != 1:
+                return None
+            
+            original = inputs[0]
+            tensor_type = original.type.tensor_type
+            if tensor_type.elem_type != TensorProto.FLOAT or len(tensor_type.shape.dim) != 4:
+                return None
+            
+            def dim_value(dim):
+                return dim.dim_param if dim.HasField("dim_param") else dim.dim_value
+            
+            n, c, h, w = (dim_value(d) for d in tensor_type.shape.dim)
+            if c != 3:
+                return None
+            
+            u8_name = f"{original.name}_u8"
+            prefix = [
+                helper.make_node("Cast", [u8_name], [f"{u8_name}_float"], to=TensorProto.FLOAT),
+                helper.make_node("Transpose", [f"{u8_name}_float"], [f"{u8_name}_nchw"], perm=[0, 3, 1, 2]),
+                helper.make_node(
+                    "Mul", [f"{u8_name}_nchw", f"{u8_name}_scale"], [original.name]
+                ),
+            ]
+            graph.initializer.append(
+                helper.make_tensor(f"{u8_name}_scale", TensorProto.FLOAT, [], [1.0 / 255.0])
+            )
+            
+            graph.input.remove(original)
+            graph.input.insert(0, helper.make_tensor_value_info(u8_name, TensorProto.UINT8, [n, h, w, c]))
+            for i, node in enumerate(prefix):
+                graph.node.insert(i, node)
+            
+            onnx.save(model, u8_path)
+            print(f"Built uint8-input model: {u8_path}")
+            return u8_path
+        except Exception as e:
+            print(f"Could not build uint8-input model, using float input: {e}")
+            return None
+    
+    @classmethod
+    def _fp16_model(cls, model_path: str) -> Optional[str]:
+        """Get (building if needed) an FP16 copy of the model for the CUDA/TensorRT EPs.
+        
+        Input and output types are kept, so callers feed and read the same
+        tensors as with the FP32 model. Returns None if it can't be built.
+        """
+        fp16_path = f"{os.path.splitext(model_path)[0]}.fp16.onnx"
+        if cls._is_cache_fresh(fp16_path, model_path):
+            return fp16_path
+        
+        try:
+            import onnx
+            from onnxruntime.transformers.float16 import convert_float_to_float16
+        except ImportError:
+            return None
+        
+        try:
+            model = convert_float_to_float16(onnx.load(model_path), keep_io_types=True)
+            onnx.save(model, fp16_path)
+            print(f"Built FP16 model: {fp16_path}")
+            return fp16_path
+        except Exception as e:
+            print(f"Could not build FP16 model, using FP32: {e}")
+            return None
+    
+    @staticmethod
+    def _int8_model_path(model_path: str) -> str:
+        """Path of the INT8 (CPU) build of a model."""
+        return f"{os.path.splitext(model_path)[0]}.int8.onnx"
+    
+    def quantize_int8(self, calibration_images: List[str]) -> str:
+        """Build an INT8 static-quantized copy of the model for CPU inference.
+        
+        Calibrates activation ranges on a handful of representative images
+        (8-16 is plenty) and writes <model>.int8.onnx, which load() picks up
+        on CPU-only machines from then on. Requires the 'onnx' package.
+        Call after load(); reload to switch the session over.
+        """
+        if self.session is None:
+            raise RuntimeError("Model not loaded. Call load() first.")
+        
+        from onnxruntime.quantization import (
+            CalibrationDataReader, QuantFormat, QuantType, quantize_static
+        )
+        
+        detector = self
+        
+        class ImageReader(CalibrationDataReader):
+            def __init__(self):
+                self._paths = iter(calibration_images)
+            
+            def get_next(self):
+                for path in self._paths:
+                    try:
+                        with Image.open(path) as image:
+                            img_array, _, _ = detector.preprocess(image.convert('RGB'))
+                        return {detector.input_name: img_array.copy()}
+                    except Exception as e:
+                        print(f"Skipping calibration image {path}: {e}")
+                return None
+        
+        base_model_path = self._uint8_input_model(self.model_path) or self.model_path
+        int8_path = self._int8_model_path(base_model_path)
+        quantize_static(
+            base_model_path,
+            int8_path,
+            ImageReader(),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            nodes_to_exclude=self._detection_head_nodes(base_model_path),
+        )
+        print(f"Built INT8 model: {int8_path}")
+        return int8_path
+    
+    @staticmethod
+    def _detection_head_nodes(model_path: str) -> List[str]:
+        """Names of the non-conv nodes between the last convolutions and the outputs.
+        
+        This is the box decode / sigmoid / concat tail, where pixel-scale box
+        coordinates and 0-1 scores share tensors; quantizing it to a single
+        uint8 range wipes out the scores, so it stays in float.
+        """
+        import onnx
+        
+        graph = onnx.load(model_path, load_external_data=False).graph
+        producers = {output: node for node in graph.node for output in node.output}
+        
+        excluded = []
+        seen = set()
+        pending = [o.name for o in graph.output]
+        while pending:
+            node = producers.get(pending.pop())
+            if node is None or node.name in seen or node.op_type == "Conv":
+                continue
+            seen.add(node.name)
+            excluded.append(node.name)
+            pending.extend(node.input)
+        return excluded
+    
+    @staticmethod
+    def _optimized_model_path(model_path: str, device: str, batch_size: int = 1) -> str:
+        """Path of the cached ORT-optimized graph for a model on a given device.
+        
+        The optimized graph bakes in the pinned batch dim, so batched sessions
+        get their own file.
+        """
+        batch_suffix = f".b{batch_size}" if batch_size > 1 else ""
+        return f"{os.path.splitext(model_path)[0]}.{device}{batch_suffix}.opt.onnx"
+    
+    @staticmethod
+    def _is_cache_fresh(cache_path: str, source_path: str) -> bool:
+        """Whether a derived model file exists and is newer than its source."""
+        return (
+            os.path.exists(cache_path)
+            and os.path.getmtime(cache_path) >= os.path.getmtime(source_path)
+        )
+    
+    def _allocate_buffers(self):
+        """Allocate the letterbox, CHW and batch input buffers reused across calls."""
+        target_w, target_h = self.input_size
+        self._pad_buf = np.full((target_h, target_w, 3), 114, dtype=np.uint8)
+        self._chw = np.empty((1, 3, target_h, target_w), dtype=np.float32)
+        self._batch_buf = None
+        if self.batch_size > 1:
+            if self.uint8_input:
+                self._batch_buf = np.empty((self.batch_size, target_h, target_w, 3), dtype=np.uint8)
+            else:
+                self._batch_buf = np.empty((self.batch_size, 3, target_h, target_w), dtype=np.float32)
+    
+    def _letterbox(
+        self,
+        image: Union[Image.Image, np.ndarray],
+        pad: np.ndarray
+    ) -> Tuple[Tuple[float, float], Tuple[int, int]]:
+        """Letterbox an image into an (H, W, 3) uint8 buffer, returning scale and pad info."""
+        if isinstance(image, Image.Image):
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image = np.asarray(image)
         
         # Resize with letterboxing to maintain aspect ratio
-        img_w, img_h = original_size
+        img_h, img_w = image.shape[:2]
         target_w, target_h = self.input_size
         
         scale = min(target_w / img_w, target_h / img_h)
         new_w = int(img_w * scale)
         new_h = int(img_h * scale)
-        
-        # Resize
-        resized = image.resize((new_w, new_h), Image.Resampling.LANCZOS)
-        
-        # Create padded image
-        padded = Image.new('RGB', self.input_size, (114, 114, 114))
         pad_x = (target_w - new_w) // 2
         pad_y = (target_h - new_h) // 2
-        padded.paste(resized, (pad_x, pad_y))
         
-        # Convert to numpy and normalize
-        img_array = np.array(padded, dtype=np.float32) / 255.0
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        
+        # Same aspect as the model input: no padding, resize straight into the buffer
+        if new_w == target_w and new_h == target_h:
+            if scale == 1:
+                pad[...] = image
+            else:
+                cv2.resize(image, (new_w, new_h), dst=pad, interpolation=interpolation)
+            return (scale, scale), (0, 0)
+        
+        # Resize into the middle of the letterbox and reset the borders, which
+        # may still hold pixels from a previous image with a different aspect
+        resized = cv2.resize(image, (new_w, new_h), interpolation=interpolation)
+        pad[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = resized
+        pad[:pad_y] = 114
+        pad[pad_y + new_h:] = 114
+        pad[:, :pad_x] = 114
+        pad[:, pad_x + new_w:] = 114
+        
+        return (scale, scale), (pad_x, pad_y)
+    
+    def preprocess(
+        self,
+        image: Union[Image.Image, np.ndarray]
+    ) -> Tuple[np.ndarray, Tuple[float, float], Tuple[int, int]]:
+        """Preprocess an image (PIL or RGB HWC uint8 array) for YOLOv8 inference.
+        
+        Letterboxes into a reused uint8 buffer and normalizes straight into a
+        reused float32 CHW buffer (or returns the uint8 letterbox itself for
+        uint8-input models), so the returned array is overwritten by the next call.
+        """
+        if self._pad_buf is None or self._pad_buf.shape[:2] != self.input_size[::-1]:
+            self._allocate_buffers()
         
-        # HWC to CHW, add batch dimension
-        img_array = img_array.transpose(2, 0, 1)
-        img_array = np.expand_dims(img_array, axis=0)
+        scale_info, pad_info = self._letterbox(image, self._pad_buf)
+        pad = self._pad_buf
         
-        # Return scale info for postprocessing
-        scale_info = (scale, scale)
-        pad_info = (pad_x, pad_y)
+        # uint8-input models normalize in-graph and take the letterbox as-is
+        if self.uint8_input:
+            return pad[np.newaxis], scale_info, pad_info
         
-        return img_array, scale_info, pad_info
+        # HWC to CHW and normalize in a single pass
+        np.divide(pad.transpose(2, 0, 1), 255.0, out=self._chw[0])
+        
+        return self._chw, scale_info, pad_info
     
     def postprocess(
         self,
@@ -175,34 +581,32 @@ class CensorDetector:
         pad_info: Tuple[int, int],
         conf_threshold: float = 0.60,
         iou_threshold: float = 0.45
-    ) -> List[Dict]:
-        """Postprocess YOLOv8 outputs to detection boxes."""
-        predictions = np.squeeze(outputs).T
+    ) -> np.ndarray:
+        """Postprocess YOLOv8 outputs to a DETECTION_DTYPE array."""
+        # Work on the [C, N] layout directly: every access below is a row
+        # slice, so transposing the whole output first is just a copy
+        predictions = outputs[0] if outputs.ndim == 3 else outputs
         
         # Extract boxes (x_center, y_center, width, height)
-        boxes = predictions[:, :4]
+        boxes = predictions[:4]
         
-        # Handle segmentation models (channels > 4 + num_classes)
+        # Segmentation models append mask coefficients after the class rows;
+        # only the class rows are scores
         num_classes = len(self.classes)
-        
-        if predictions.shape[1] > 4 + num_classes:
-            # Segmentation model detected: Only use class columns, ignore mask coeffs
-            scores = predictions[:, 4:4+num_classes]
-        else:
-            scores = predictions[:, 4:]
+        scores = predictions[4:4 + num_classes]
         
         # Get max class score and class id for each box
-        class_ids = np.argmax(scores, axis=1)
-        confidences = np.max(scores, axis=1)
+        class_ids = np.argmax(scores, axis=0)
+        confidences = np.max(scores, axis=0)
         
         # Filter by confidence
         mask = confidences >= conf_threshold
-        boxes = boxes[mask]
+        boxes = boxes[:, mask].T
         confidences = confidences[mask]
         class_ids = class_ids[mask]
         
         if len(boxes) == 0:
-            return []
+            return np.empty(0, dtype=DETECTION_DTYPE)
         
         # Convert from center to corner format
         x_center, y_center, width, height = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
@@ -231,110 +635,355 @@ class CensorDetector:
         boxes_xyxy = np.stack([x1, y1, x2, y2], axis=1)
         indices = self._nms(boxes_xyxy, confidences, iou_threshold)
         
-        detections = []
-        for i in indices:
-            class_id = int(class_ids[i])
-            class_name = self.classes[class_id] if class_id < len(self.classes) else f"class_{class_id}"
-            
-            detections.append({
-                "class": class_name,
-                "class_id": class_id,
-                "confidence": float(confidences[i]),
-                "box": [int(x1[i]), int(y1[i]), int(x2[i]), int(y2[i])]
-            })
+        detections = np.empty(len(indices), dtype=DETECTION_DTYPE)
+        detections['class_id'] = class_ids[indices]
+        detections['conf'] = confidences[indices]
+        detections['x1'] = x1[indices]
+        detections['y1'] = y1[indices]
+        detections['x2'] = x2[indices]
+        detections['y2'] = y2[indices]
         
         return detections
     
+    def detections_to_dicts(self, detections: np.ndarray) -> List[Dict]:
+        """JSON-ready dicts (class, class_id, confidence, box) for a detections array."""
+        return [
+            {
+                "class": self.classes[class_id] if class_id < len(self.classes) else f"class_{class_id}",
+                "class_id": class_id,
+                "confidence": confidence,
+                "box": [x1, y1, x2, y2]
+            }
+            for class_id, confidence, x1, y1, x2, y2 in detections.tolist()
+        ]
+    
     def _nms(self, boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> List[int]:
-        """Non-maximum suppression."""
-        x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
-        areas = (x2 - x1) * (y2 - y1)
+        """Non-maximum suppression.
         
+        Vectorized greedy NMS: builds the pairwise IoU matrix once, then iterates
+        "a box survives unless a higher-scoring surviving box overlaps it" to a
+        fixed point (Cluster-NMS), which gives the same result as the sequential
+        greedy loop in a handful of array passes. When numba is installed the
+        sequential loop is JIT-compiled instead, which avoids the N x N matrix.
+        """
         order = scores.argsort()[::-1]
-        keep = []
+        b = boxes[order]
         
-        while order.size > 0:
-            i = order[0]
-            keep.append(i)
-            
-            if order.size == 1:
+        if _nms_numba is not None:
+            x1, y1, x2, y2 = np.ascontiguousarray(b.T, dtype=np.float32)
+            keep = _nms_numba(x1, y1, x2, y2, (x2 - x1) * (y2 - y1), iou_threshold)
+            return order[keep].tolist()
+        
+        x1, y1, x2, y2 = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+        areas = (x2 - x1) * (y2 - y1)
+        
+        # Pairwise IoU between score-sorted boxes
+        w = np.maximum(0.0, np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]))
+        h = np.maximum(0.0, np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]))
+        inter = w * h
+        iou = inter / (areas[:, None] + areas[None, :] - inter + 1e-6)  # Added epsilon to prevent div/0
+        
+        # suppresses[i, j]: higher-ranked box i overlaps lower-ranked box j too much
+        suppresses = np.triu(iou > iou_threshold, k=1)
+        
+        keep = np.ones(len(order), dtype=bool)
+        while True:
+            new_keep = ~(suppresses & keep[:, None]).any(axis=0)
+            if np.array_equal(new_keep, keep):
                 break
-            
-            # Compute IoU
-            xx1 = np.maximum(x1[i], x1[order[1:]])
-            yy1 = np.maximum(y1[i], y1[order[1:]])
-            xx2 = np.minimum(x2[i], x2[order[1:]])
-            yy2 = np.minimum(y2[i], y2[order[1:]])
-            
-            w = np.maximum(0.0, xx2 - xx1)
-            h = np.maximum(0.0, yy2 - yy1)
-            inter = w * h
-            
-            iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-6)  # Added epsilon to prevent div/0
-            
-            # Keep boxes with IoU below threshold
-            inds = np.where(iou <= iou_threshold)[0]
-            order = order[inds + 1]
+            keep = new_keep
         
-        return keep
+        return order[keep].tolist()
     
-    def detect(self, image_path: str, conf_threshold: float = 0.6) -> List[Dict]:
+    @staticmethod
+    def _image_size(image: Union[Image.Image, np.ndarray]) -> Tuple[int, int]:
+        """(width, height) of a PIL image or HWC array."""
+        if isinstance(image, Image.Image):
+            return image.size
+        return image.shape[1], image.shape[0]
+    
+    # cv2 flags for libjpeg's scaled DCT decode, largest reduction first
+    _REDUCED_JPEG_FLAGS = (
+        (8, cv2.IMREAD_REDUCED_COLOR_8),
+        (4, cv2.IMREAD_REDUCED_COLOR_4),
+        (2, cv2.IMREAD_REDUCED_COLOR_2),
+    )
+    
+    def _read_rgb(self, image_path: str) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """Decode an image file straight to an RGB HWC uint8 array.
+        
+        Returns the array and the file's full (width, height). JPEGs much
+        larger than the model input are decoded at 1/2, 1/4 or 1/8 scale by
+        libjpeg (never below what the letterbox needs), so the array may be
+        smaller than the file; callers map boxes back with original_size.
+        
+        Uses OpenCV's decoders (imdecode over np.fromfile, so non-ASCII paths
+        work on Windows) and ignores EXIF orientation so boxes line up with the
+        PIL-decoded image that gets censored. Formats OpenCV can't read, such
+        as GIF, fall back to Pillow.
+        """
+        data = np.fromfile(image_path, dtype=np.uint8)
+        flags = cv2.IMREAD_COLOR
+        original_size = None
+        
+        if data[:2].tobytes() == b'\xff\xd8':
+            # Only the header is read here; the pixels are decoded by OpenCV
+            with Image.open(image_path) as header:
+                original_size = header.size
+            target_w, target_h = self.input_size
+            scale = min(target_w / original_size[0], target_h / original_size[1])
+            for factor, reduced_flag in self._REDUCED_JPEG_FLAGS:
+                if factor * scale <= 1:
+                    flags = reduced_flag
+                    break
+        
+        bgr = cv2.imdecode(data, flags | cv2.IMREAD_IGNORE_ORIENTATION)
+        if bgr is None:
+            with Image.open(image_path) as image:
+                rgb = np.asarray(image.convert('RGB'))
+        else:
+            rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        
+        return rgb, original_size or self._image_size(rgb)
+    
+    @staticmethod
+    def _source_scale(
+        scale_info: Tuple[float, float],
+        decoded_size: Tuple[int, int],
+        original_size: Tuple[int, int]
+    ) -> Tuple[float, float]:
+        """Letterbox scale relative to the source image, for a reduced-size decode of it."""
+        return (
+            scale_info[0] * decoded_size[0] / original_size[0],
+            scale_info[1] * decoded_size[1] / original_size[1],
+        )
+    
+    def _infer(self, img_array: np.ndarray) -> List[np.ndarray]:
+        """Run the session on a preprocessed input, using IOBinding on CUDA."""
+        if self.io_binding is None:
+            return self.session.run(None, {self.input_name: img_array}, run_options=self.run_options)
+        
+        self.input_ortvalue.update_inplace(np.ascontiguousarray(img_array))
+        self.session.run_with_iobinding(self.io_binding, run_options=self.run_options)
+        return self.io_binding.copy_outputs_to_cpu()
+    
+    def detect(self, image_path: str, conf_threshold: float = 0.6) -> np.ndarray:
         """Run detection on an image file."""
         if self.session is None:
             raise RuntimeError("Model not loaded. Call load() first.")
         
-        # Load and preprocess image
-        image = Image.open(image_path).convert('RGB')
-        original_size = image.size
+        image, original_size = self._read_rgb(image_path)
+        return self.detect_from_image(image, conf_threshold, original_size)
+    
+    def detect_from_image(
+        self,
+        image: Union[Image.Image, np.ndarray],
+        conf_threshold: float = 0.6,
+        original_size: Optional[Tuple[int, int]] = None
+    ) -> np.ndarray:
+        """Run detection on a PIL Image or RGB HWC uint8 array.
+        
+        original_size is the (width, height) of the source when image is a
+        reduced-size decode of it; boxes are returned in source pixels.
+        """
+        if self.session is None:
+            raise RuntimeError("Model not loaded. Call load() first.")
+        
+        if self.batch_size > 1:
+            return self.detect_batch([image], conf_threshold, [original_size])[0]
         
+        decoded_size = self._image_size(image)
         img_array, scale_info, pad_info = self.preprocess(image)
+        if original_size is None:
+            original_size = decoded_size
+        elif original_size != decoded_size:
+            scale_info = self._source_scale(scale_info, decoded_size, original_size)
         
         # Run inference
-        outputs = self.session.run(None, {self.input_name: img_array})
+        outputs = self._infer(img_array)
         
         # Postprocess
         detections = self.postprocess(
-            outputs[0], 
+            outputs[0],
             original_size,
-            scale_info, 
+            scale_info,
             pad_info,
             conf_threshold
         )
         
         return detections
     
-    def detect_from_image(self, image: Image.Image, conf_threshold: float = 0.6) -> List[Dict]:
-        """Run detection on a PIL Image."""
+    def detect_batch(
+        self,
+        images: List[Union[Image.Image, np.ndarray]],
+        conf_threshold: float = 0.6,
+        original_sizes: Optional[List[Optional[Tuple[int, int]]]] = None
+    ) -> List[np.ndarray]:
+        """Run detection on several images, batch_size images per session run.
+        
+        Returns one detections array per input image, in order. A final partial
+        batch is run with the leftover rows of the batch buffer unused.
+        original_sizes works as in detect_from_image, one entry per image.
+        """
         if self.session is None:
             raise RuntimeError("Model not loaded. Call load() first.")
         
-        original_size = image.size
-        img_array, scale_info, pad_info = self.preprocess(image)
+        if original_sizes is None:
+            original_sizes = [None] * len(images)
         
-        outputs = self.session.run(None, {self.input_name: img_array})
+        if self.batch_size == 1:
+            return [
+                self.detect_from_image(image, conf_threshold, original_size)
+                for image, original_size in zip(images, original_sizes)
+            ]
         
-        detections = self.postprocess(
-            outputs[0],
-            original_size,
-            scale_info,
-            pad_info,
-            conf_threshold
-        )
+        results = []
+        for start in range(0, len(images), self.batch_size):
+            chunk = images[start:start + self.batch_size]
+            
+            # Fill one batch row per image, keeping its letterbox info
+            batch_info = []
+            for row, image in enumerate(chunk):
+                img_array, scale_info, pad_info = self.preprocess(image)
+                self._batch_buf[row] = img_array[0]
+                decoded_size = self._image_size(image)
+                original_size = original_sizes[start + row] or decoded_size
+                if original_size != decoded_size:
+                    scale_info = self._source_scale(scale_info, decoded_size, original_size)
+                batch_info.append((original_size, scale_info, pad_info))
+            
+            outputs = self._infer(self._batch_buf)
+            
+            for row, (original_size, scale_info, pad_info) in enumerate(batch_info):
+                results.append(self.postprocess(
+                    outputs[0][row:row + 1],
+                    original_size,
+                    scale_info,
+                    pad_info,
+                    conf_threshold
+                ))
         
-        return detections
+        return results
+    
+    def detect_many(
+        self,
+        image_paths: List[str],
+        conf_threshold: float = 0.6,
+        max_workers: int = 4
+    ) -> List[np.ndarray]:
+        """Run detection on many image files through a three-stage pipeline.
+        
+        max_workers threads decode and letterbox images (OpenCV and NumPy
+        release the GIL) into a bounded queue. The calling thread drains it
+        into the session, batch_size images per run, so the session is only
+        ever driven from one thread, and a second pool postprocesses outputs
+        while the next batch runs. Returns one detections array per path,
+        in order; images that fail to load get an empty array.
+        """
+        if self.session is None:
+            raise RuntimeError("Model not loaded. Call load() first.")
+        if self._pad_buf is None or self._pad_buf.shape[:2] != self.input_size[::-1]:
+            self._allocate_buffers()
+        
+        target_w, target_h = self.input_size
+        ready = queue.Queue(maxsize=max_workers * 2)
+        stop = threading.Event()
+        
+        def load(index: int, path: str):
+            if stop.is_set():
+                return
+            try:
+                image, original_size = self._read_rgb(path)
+                # Private buffers: the shared ones in preprocess() are not thread-safe
+                pad = np.empty((target_h, target_w, 3), dtype=np.uint8)
+                scale_info, pad_info = self._letterbox(image, pad)
+                if self.uint8_input:
+                    img_array = pad[np.newaxis]
+                else:
+                    img_array = np.empty((1, 3, target_h, target_w), dtype=np.float32)
+                    np.divide(pad.transpose(2, 0, 1), 255.0, out=img_array[0])
+                decoded_size = self._image_size(image)
+                if original_size != decoded_size:
+                    scale_info = self._source_scale(scale_info, decoded_size, original_size)
+                ready.put((index, img_array, (original_size, scale_info, pad_info)))
+            except Exception as e:
+                print(f"[Censor] Error loading {path}: {e}")
+                ready.put((index, None, None))
+        
+        results = [np.empty(0, dtype=DETECTION_DTYPE) for _ in image_paths]
+        pending = []
+        
+        def run(chunk):
+            if self.batch_size == 1:
+                outputs = self._infer(chunk[0][1])
+            else:
+                for row, (_, img_array, _) in enumerate(chunk):
+                    self._batch_buf[row] = img_array[0]
+                outputs = self._infer(self._batch_buf)
+            for row, (index, _, (original_size, scale_info, pad_info)) in enumerate(chunk):
+                pending.append((index, post_pool.submit(
+                    self.postprocess,
+                    outputs[0][row:row + 1],
+                    original_size,
+                    scale_info,
+                    pad_info,
+                    conf_threshold
+                )))
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as load_pool, \
+                ThreadPoolExecutor(max_workers=max(1, max_workers // 2)) as post_pool:
+            futures = [load_pool.submit(load, index, path) for index, path in enumerate(image_paths)]
+            try:
+                chunk = []
+                for _ in range(len(image_paths)):
+                    item = ready.get()
+                    if item[1] is None:
+                        continue
+                    chunk.append(item)
+                    if len(chunk) == self.batch_size:
+                        run(chunk)
+                        chunk = []
+                if chunk:
+                    run(chunk)
+            except BaseException:
+                # Unblock loaders waiting on a full queue so the pool can shut down
+                stop.set()
+                while not all(future.done() for future in futures):
+                    try:
+                        ready.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+                raise
+            
+            for index, future in pending:
+                results[index] = future.result()
+        
+        return results
 
 
 class Censor:
     """Image censoring utilities."""
     
+    # Sticker images already resized to a region size, keyed by
+    # (path, mtime, width, height) and shared across calls
+    STICKER_CACHE_SIZE = 16
+    _sticker_cache: "OrderedDict[Tuple[str, float, int, int], Image.Image]" = OrderedDict()
+    _sticker_cache_lock = threading.Lock()
+    
     @staticmethod
     def apply_mosaic(
         image: Image.Image, 
         regions: List[Tuple[int, int, int, int]], 
-        block_size: int = 16
+        block_size: int = 16,
+        inplace: bool = False
     ) -> Image.Image:
-        """Apply mosaic/pixelation to regions."""
-        result = image.copy()
+        """Apply mosaic/pixelation to regions.
+        
+        Each block_size x block_size tile (smaller at the region's right/bottom
+        edge) is replaced by its mean color, computed with NumPy on the region.
+        """
+        result = image if inplace else image.copy()
+        block_size = max(1, block_size)
         
         for x1, y1, x2, y2 in regions:
             # Ensure valid coordinates
@@ -344,19 +993,22 @@ class Censor:
             if x2 <= x1 or y2 <= y1:
                 continue
             
-            # Extract region
-            region = result.crop((x1, y1, x2, y2))
+            region = np.array(result.crop((x1, y1, x2, y2)))
+            h, w = region.shape[:2]
             
-            # Pixelate: resize down then up
-            w, h = region.size
-            small_w = max(1, w // block_size)
-            small_h = max(1, h // block_size)
+            # Per-tile sums over uneven tiles, then broadcast the means back
+            row_starts = np.arange(0, h, block_size)
+            col_starts = np.arange(0, w, block_size)
+            row_sizes = np.diff(np.append(row_starts, h))
+            col_sizes = np.diff(np.append(col_starts, w))
             
-            small = region.resize((small_w, small_h), Image.Resampling.NEAREST)
-            pixelated = small.resize((w, h), Image.Resampling.NEAREST)
+            sums = np.add.reduceat(region, row_starts, axis=0, dtype=np.uint32)
+            sums = np.add.reduceat(sums, col_starts, axis=1)
+            counts = np.outer(row_sizes, col_sizes).reshape(sums.shape[:2] + (1,) * (region.ndim - 2))
+            means = (sums + counts // 2) // counts
             
-            # Paste back
-            result.paste(pixelated, (x1, y1))
+            region[:] = np.repeat(np.repeat(means, row_sizes, axis=0), col_sizes, axis=1)
+            result.paste(Image.fromarray(region), (x1, y1))
         
         return result
     
@@ -364,10 +1016,11 @@ class Censor:
     def apply_bar(
         image: Image.Image,
         regions: List[Tuple[int, int, int, int]],
-        color: Tuple[int, int, int] = (0, 0, 0)
+        color: Tuple[int, int, int] = (0, 0, 0),
+        inplace: bool = False
     ) -> Image.Image:
         """Apply solid color bar to regions."""
-        result = image.copy()
+        result = image if inplace else image.copy()
         draw = ImageDraw.Draw(result)
         
         for x1, y1, x2, y2 in regions:
@@ -379,10 +1032,15 @@ class Censor:
     def apply_blur(
         image: Image.Image,
         regions: List[Tuple[int, int, int, int]],
-        blur_radius: int = 20
+        blur_radius: int = 20,
+        inplace: bool = False
     ) -> Image.Image:
-        """Apply gaussian blur to regions."""
-        result = image.copy()
+        """Apply gaussian blur to regions (a radius of 0 or less leaves them as is)."""
+        result = image if inplace else image.copy()
+        # cv2 rejects a zero sigma with a zero kernel size; PIL's GaussianBlur(0)
+        # was a no-op
+        if blur_radius <= 0:
+            return result
         
         for x1, y1, x2, y2 in regions:
             x1, y1 = max(0, x1), max(0, y1)
@@ -391,38 +1049,62 @@ class Censor:
             if x2 <= x1 or y2 <= y1:
                 continue
             
-            region = result.crop((x1, y1, x2, y2))
-            blurred = region.filter(ImageFilter.GaussianBlur(radius=blur_radius))
-            result.paste(blurred, (x1, y1))
+            # blur_radius is the Gaussian sigma, as with PIL's GaussianBlur
+            region = np.array(result.crop((x1, y1, x2, y2)))
+            blurred = cv2.GaussianBlur(region, (0, 0), blur_radius)
+            result.paste(Image.fromarray(blurred), (x1, y1))
         
         return result
     
-    @staticmethod
+    @classmethod
     def apply_sticker(
+        cls,
         image: Image.Image,
         regions: List[Tuple[int, int, int, int]],
         sticker_path: str = None,
-        sticker_emoji: str = "⭐"
+        sticker_emoji: str = "⭐",
+        inplace: bool = False
     ) -> Image.Image:
-        """Apply sticker overlay to regions."""
-        result = image.copy()
+        """Apply sticker overlay to regions.
+        
+        The sticker is resized once per unique region size (bilinear; it is
+        decorative) and reused from a small LRU cache across calls.
+        """
+        result = image if inplace else image.copy()
         
         if sticker_path and os.path.exists(sticker_path):
-            sticker = Image.open(sticker_path).convert('RGBA')
+            sticker_mtime = os.path.getmtime(sticker_path)
+            sticker = None  # Decoded on the first cache miss
+            draw = None
         else:
             # Create simple emoji-style sticker
-            sticker = None
+            sticker_path = None
+            draw = ImageDraw.Draw(result)
         
         for x1, y1, x2, y2 in regions:
             w, h = x2 - x1, y2 - y1
             
-            if sticker:
+            if sticker_path:
                 # Resize sticker to fit region
-                resized = sticker.resize((w, h), Image.Resampling.LANCZOS)
+                key = (sticker_path, sticker_mtime, w, h)
+                with cls._sticker_cache_lock:
+                    resized = cls._sticker_cache.get(key)
+                    if resized is not None:
+                        cls._sticker_cache.move_to_end(key)
+                
+                if resized is None:
+                    if sticker is None:
+                        with Image.open(sticker_path) as source:
+                            sticker = source.convert('RGBA')
+                    resized = sticker.resize((w, h), Image.Resampling.BILINEAR)
+                    with cls._sticker_cache_lock:
+                        cls._sticker_cache[key] = resized
+                        while len(cls._sticker_cache) > cls.STICKER_CACHE_SIZE:
+                            cls._sticker_cache.popitem(last=False)
+                
                 result.paste(resized, (x1, y1), resized)
             else:
                 # Draw simple star/circle overlay
-                draw = ImageDraw.Draw(result)
                 center_x = (x1 + x2) // 2
                 center_y = (y1 + y2) // 2
                 radius = min(w, h) // 2
@@ -439,37 +1121,68 @@ class Censor:
         image: Image.Image,
         regions: List[Tuple[int, int, int, int]],
         style: str = "mosaic",
+        inplace: bool = False,
         **kwargs
     ) -> Image.Image:
-        """Apply censoring with specified style."""
+        """Apply censoring with specified style.
+        
+        With inplace=True the given image is modified and returned instead of
+        a full copy being made; use it when the caller owns the image.
+        """
         if style == "mosaic":
             block_size = kwargs.get("block_size", 16)
-            return Censor.apply_mosaic(image, regions, block_size)
+            return Censor.apply_mosaic(image, regions, block_size, inplace=inplace)
         elif style == "black_bar":
-            return Censor.apply_bar(image, regions, (0, 0, 0))
+            return Censor.apply_bar(image, regions, (0, 0, 0), inplace=inplace)
         elif style == "white_bar":
-            return Censor.apply_bar(image, regions, (255, 255, 255))
+            return Censor.apply_bar(image, regions, (255, 255, 255), inplace=inplace)
         elif style == "blur":
             blur_radius = kwargs.get("blur_radius", 20)
-            return Censor.apply_blur(image, regions, blur_radius)
+            return Censor.apply_blur(image, regions, blur_radius, inplace=inplace)
         elif style == "sticker":
             sticker_path = kwargs.get("sticker_path")
-            return Censor.apply_sticker(image, regions, sticker_path)
+            return Censor.apply_sticker(image, regions, sticker_path, inplace=inplace)
         else:
             raise ValueError(f"Unknown censor style: {style}")
 
 
-# Global detector instance (lazy loaded)
-_detector: Optional[CensorDetector] = None
+# Loaded detectors keyed by model path, least recently used first. Building a
+# session (graph optimization, kernel setup) is the expensive part, so switching
+# between a few models reuses them instead of rebuilding each time.
+MAX_CACHED_DETECTORS = 4
+_detector_cache: "OrderedDict[str, CensorDetector]" = OrderedDict()
+_detector_cache_lock = threading.Lock()
 
 
 def get_detector(model_path: str = None) -> CensorDetector:
-    """Get or create the global detector instance."""
-    global _detector
-    
-    if _detector is None or (model_path and _detector.model_path != model_path):
-        _detector = CensorDetector(model_path)
-        if model_path:
-            _detector.load()
+    """Get a loaded detector for model_path, reusing a cached one when possible.
     
-    return _detector
+    Without a model_path, returns the most recently used detector (or a new,
+    unloaded one if none has been loaded yet).
+    """
+    with _detector_cache_lock:
+        if not model_path:
+            if _detector_cache:
+                return next(reversed(_detector_cache.values()))
+            return CensorDetector()
+        
+        detector = _detector_cache.get(model_path)
+        if detector is not None and detector.session is not None:
+            _detector_cache.move_to_end(model_path)
+            return detector
+        
+        detector = CensorDetector(model_path)
+        detector.load()
+        _detector_cache[model_path] = detector
+        _detector_cache.move_to_end(model_path)
+        
+        # Evict least recently used sessions and release their (GPU) memory
+        while len(_detector_cache) > MAX_CACHED_DETECTORS:
+            _, evicted = _detector_cache.popitem(last=False)
+            evicted.session = None
+            evicted.io_binding = None
+            evicted.input_ortvalue = None
+            del evicted
+            gc.collect()
+        
+        return detector
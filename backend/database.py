@@ -4,13 +4,23 @@ SQLite database for storing image metadata and tags.
 import sqlite3
 import os
 import json
+import random
+import threading
+import time
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator, Iterable
+from itertools import islice, groupby
 from contextlib import contextmanager
+from functools import lru_cache
 
 DATABASE_PATH = os.path.join(os.path.dirname(__file__), "images.db")
 
+# Prompts and LORA lists repeat the same few thousand strings across a
+# library, so the (pure) normalizers below are memoized
+NORMALIZE_CACHE_SIZE = 8192
 
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
 def normalize_prompt_token(token: str) -> str:
     """Normalize a prompt token for consistent matching.
     
@@ -24,6 +34,7 @@ def normalize_prompt_token(token: str) -> str:
     return token.lower().replace('_', ' ').strip()
 
 
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
 def normalize_lora_name(lora_name: str) -> str:
     """Normalize a LORA name for consistent matching.
     
@@ -57,6 +68,39 @@ def normalize_lora_name(lora_name: str) -> str:
 
 import re
 
+# Prompt and LORA parsing runs once per candidate row in get_images and per
+# image at ingest, so the patterns are compiled once here
+_TAG_PAIR_RE = re.compile(r'<[^>]+>[^<]*</[^>]+>')
+_LORA_TAG_RE = re.compile(r'<lora:[^>]+>')
+_ANY_TAG_RE = re.compile(r'<[^>]+>')
+_PAREN_STRIP_RE = re.compile(r'^\(+|\)+$')
+_WEIGHT_RE = re.compile(r':\d+\.?\d*\)?$')
+_LORA_EXTRACT_RE = re.compile(r'<lora:([^:>]+)(?::[^>]+)?>', re.IGNORECASE)
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _clean_prompt_token(token: str) -> Optional[str]:
+    """Normalize one comma-separated prompt entry, or None if too short.
+    
+    Prompts share most of their entries ("masterpiece", "1girl", ...), so
+    the whole per-entry cleanup is memoized, not just the final normalize.
+    """
+    token = token.strip()
+    # Remove leading/trailing parentheses and weight suffixes; each regex
+    # only runs when the token has the character it looks for
+    if token[:1] == '(' or token[-1:] == ')':
+        token = _PAREN_STRIP_RE.sub('', token)
+    if ':' in token:
+        token = _WEIGHT_RE.sub('', token)
+    token = token.strip()
+    
+    if token and len(token) > 1:
+        normalized = normalize_prompt_token(token)
+        if normalized and len(normalized) > 1:
+            return normalized
+    return None
+
+
 def extract_prompt_tokens(prompt: str) -> set:
     """Extract normalized tokens from a prompt string.
     
@@ -67,25 +111,14 @@ def extract_prompt_tokens(prompt: str) -> set:
         return set()
     
     # Remove XML-like tags and lora tags
-    clean_prompt = re.sub(r'<[^>]+>[^<]*</[^>]+>', '', prompt)
-    clean_prompt = re.sub(r'<lora:[^>]+>', '', clean_prompt)
-    clean_prompt = re.sub(r'<[^>]+>', '', clean_prompt)
-    
-    tokens = set()
-    for token in clean_prompt.split(','):
-        token = token.strip()
-        if not token:
-            continue
-        # Remove leading/trailing parentheses and weight suffixes
-        clean_token = re.sub(r'^\(+|\)+$', '', token)
-        clean_token = re.sub(r':\d+\.?\d*\)?$', '', clean_token)
-        clean_token = clean_token.strip()
-        
-        if clean_token and len(clean_token) > 1:
-            normalized = normalize_prompt_token(clean_token)
-            if normalized and len(normalized) > 1:
-                tokens.add(normalized)
+    clean_prompt = prompt
+    if '<' in clean_prompt:
+        clean_prompt = _TAG_PAIR_RE.sub('', clean_prompt)
+        clean_prompt = _LORA_TAG_RE.sub('', clean_prompt)
+        clean_prompt = _ANY_TAG_RE.sub('', clean_prompt)
     
+    tokens = {_clean_prompt_token(token) for token in clean_prompt.split(',')}
+    tokens.discard(None)
     return tokens
 
 
@@ -110,7 +143,7 @@ def extract_lora_names(loras_json: str, prompt: str) -> set:
     
     # Extract from prompt (format: <lora:name:weight>)
     if prompt:
-        lora_matches = re.findall(r'<lora:([^:>]+)(?::[^>]+)?>', prompt, re.IGNORECASE)
+        lora_matches = _LORA_EXTRACT_RE.findall(prompt)
         for lora_name in lora_matches:
             if lora_name and len(lora_name) > 2:
                 normalized = normalize_lora_name(lora_name)
@@ -119,34 +152,239 @@ def extract_lora_names(loras_json: str, prompt: str) -> set:
     
     return loras
 
+# Per-connection tuning. journal_mode=WAL is persistent in the database file
+# and is set once in init_db(); with WAL, synchronous=NORMAL only fsyncs at
+# checkpoints and readers no longer block behind the tagging writer.
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA busy_timeout=5000",
+)
+
+DATABASE_PAGE_SIZE = 8192
+
+# Whether the images_fts search index exists (SQLite built with FTS5)
+FTS_AVAILABLE = False
+
+# Trigram FTS matches substrings like the LIKE scan it replaces, but can
+# only look up queries of at least this many characters
+FTS_MIN_QUERY_LENGTH = 3
+
+
+def is_memory_database(path: str) -> bool:
+    """Whether a database path refers to an in-memory SQLite database."""
+    return path in ("", ":memory:") or path.startswith("file::memory:")
+
+
+# Columns of the images table that list queries may project
+IMAGE_COLUMNS = (
+    "id", "path", "filename", "generator", "prompt", "negative_prompt",
+    "metadata_json", "width", "height", "file_size", "checkpoint", "loras",
+    "created_at", "indexed_at", "tagged_at", "rating", "aspect_class",
+)
+
+# Default projection for image lists (gallery, sorting, tagging queues).
+# Leaves out the prompt and metadata blobs; get_image_by_id returns the full row.
+IMAGE_LIST_FIELDS = (
+    "id", "path", "filename", "generator", "width", "height", "file_size",
+    "checkpoint", "created_at", "tagged_at",
+)
+
+
+def image_select_list(fields, alias: str = "") -> str:
+    """Comma-separated column list for the given image fields, validated."""
+    unknown = set(fields) - set(IMAGE_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown image fields: {sorted(unknown)}")
+    return ", ".join(f"{alias}{field}" for field in fields)
+
+
+def fetch_dicts(cursor: sqlite3.Cursor) -> List[Dict[str, Any]]:
+    """Fetch all rows of an executed cursor as dicts, building the key list once."""
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def fts_phrase(text: str) -> str:
+    """Quote text as a single FTS5 phrase (a substring match with trigrams)."""
+    return '"' + text.replace('"', '""') + '"'
+
+
 def get_connection() -> sqlite3.Connection:
-    """Get a database connection with row factory."""
-    conn = sqlite3.connect(DATABASE_PATH)
+    """Open a new database connection with row factory and tuning PRAGMAs applied.
+    
+    The connection is in autocommit mode (isolation_level=None); get_db()
+    issues BEGIN/COMMIT itself.
+    """
+    conn = sqlite3.connect(
+        DATABASE_PATH,
+        check_same_thread=False,
+        cached_statements=256,
+        isolation_level=None
+    )
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# One long-lived connection per thread, so prepared statements stay cached
+# between calls instead of being thrown away with a connect/close per query
+_thread_local = threading.local()
+_open_connections = set()
+_open_connections_lock = threading.Lock()
+
+
+def get_thread_connection() -> sqlite3.Connection:
+    """Get this thread's connection, opening it on first use."""
+    conn = getattr(_thread_local, "conn", None)
+    # A connection missing from _open_connections was closed by close_all_connections()
+    if conn is None or _thread_local.path != DATABASE_PATH or conn not in _open_connections:
+        if conn is not None and conn in _open_connections:
+            close_connection(conn)
+        conn = _thread_local.conn = get_connection()
+        _thread_local.path = DATABASE_PATH
+        with _open_connections_lock:
+            _open_connections.add(conn)
     return conn
 
 
+def close_connection(conn: sqlite3.Connection):
+    """Close a connection, first letting SQLite refresh stale planner statistics.
+    
+    PRAGMA optimize only re-analyzes tables whose queries on this connection
+    would benefit, so it is usually a no-op and cheap to run on every close.
+    """
+    with _open_connections_lock:
+        _open_connections.discard(conn)
+    try:
+        conn.execute("PRAGMA optimize")
+    except sqlite3.Error as e:
+        print(f"PRAGMA optimize failed: {e}")
+    conn.close()
+
+
+def close_all_connections():
+    """Close every per-thread connection (call at shutdown)."""
+    with _open_connections_lock:
+        connections = list(_open_connections)
+    for conn in connections:
+        close_connection(conn)
+
+
 @contextmanager
-def get_db():
-    """Context manager for database connections."""
-    conn = get_connection()
+def get_db(immediate: bool = False):
+    """Context manager for a transaction on this thread's connection.
+    
+    Commits on success and rolls back on error. A get_db() nested inside
+    another on the same thread joins the outer transaction. immediate=True
+    takes the write lock up front (BEGIN IMMEDIATE) for write transactions
+    that read first, so they wait on busy_timeout instead of failing later.
+    """
+    conn = get_thread_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
     try:
         yield conn
-        conn.commit()
+        if conn.in_transaction:
+            conn.execute("COMMIT")
     except Exception:
-        conn.rollback()
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
         raise
-    finally:
-        conn.close()
+
+
+@contextmanager
+def read_db():
+    """Yield this thread's connection for a single-statement read.
+    
+    Skips the BEGIN/COMMIT round trip of get_db(): in autocommit mode one
+    statement already reads a consistent snapshot. Use get_db() when several
+    statements must see the same snapshot.
+    """
+    yield get_thread_connection()
+
+
+# Rating tags ranked for the rating sort: explicit > questionable >
+# sensitive > general, with 5 for unrated images
+RATING_TAGS_SQL = "('explicit', 'questionable', 'sensitive', 'general')"
+RATING_ORDER_SQL = """CASE tag
+    WHEN 'explicit' THEN 1
+    WHEN 'questionable' THEN 2
+    WHEN 'sensitive' THEN 3
+    WHEN 'general' THEN 4
+END"""
+
+
+# Aspect ratio class for the aspect_ratio filter, kept as an indexed
+# generated column so the filter doesn't divide width by height per row.
+# Images with unknown dimensions fall into 'other'.
+ASPECT_CLASS_SQL = """CASE
+    WHEN ABS(CAST(width AS FLOAT) / height - 1.0) < 0.1 THEN 'square'
+    WHEN CAST(width AS FLOAT) / height > 1.1 THEN 'landscape'
+    WHEN CAST(width AS FLOAT) / height < 0.9 THEN 'portrait'
+    ELSE 'other'
+END"""
+ASPECT_CLASSES = ('square', 'landscape', 'portrait')
+
+
+# Bumped whenever _create_schema() gains a migration; stored in the
+# database file as PRAGMA user_version
+SCHEMA_VERSION = 6
+
+# Oldest SQLite the queries run on: upsert ... RETURNING and MATERIALIZED
+# CTEs need 3.35
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+_schema_lock = threading.Lock()
+_schema_initialized_path = None
 
 
 def init_db():
-    """Initialize the database schema."""
+    """Initialize the database schema.
+    
+    Call once at startup (the app does so in its lifespan handler); it is
+    not run on import. Repeated calls for the same DATABASE_PATH are no-ops.
+    """
+    global _schema_initialized_path
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        raise RuntimeError(
+            f"SQLite {sqlite3.sqlite_version} is too old; SD Image Sorter needs "
+            f"{'.'.join(map(str, MIN_SQLITE_VERSION))} or newer (upgrade Python or its sqlite3 library)"
+        )
+    with _schema_lock:
+        if _schema_initialized_path == DATABASE_PATH:
+            return
+        _create_schema()
+        _schema_initialized_path = DATABASE_PATH
+
+
+def _create_schema():
+    """Create tables, indexes and search triggers, and run pending migrations."""
+    # 8 KB pages keep the b-trees shallower for the index-driven gallery
+    # reads. This only takes effect on a fresh database file (existing files
+    # keep their page size, and WAL mode can't change it), so set it first.
+    get_thread_connection().execute(f"PRAGMA page_size={DATABASE_PAGE_SIZE}")
+    
+    # WAL lets readers run alongside a writer; it is stored in the file
+    # header, so it only needs setting once. In-memory databases can't use it.
+    # It can't be changed inside a transaction, so set it before get_db().
+    if not is_memory_database(DATABASE_PATH):
+        get_thread_connection().execute("PRAGMA journal_mode=WAL")
+    
     with get_db() as conn:
         cursor = conn.cursor()
+        cursor.execute("PRAGMA user_version")
+        schema_version = cursor.fetchone()[0]
         
         # Images table
-        cursor.execute("""
+        cursor.execute(f"""
             CREATE TABLE IF NOT EXISTS images (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 path TEXT UNIQUE NOT NULL,
@@ -162,17 +400,37 @@ def init_db():
                 loras TEXT, -- JSON array of lora names
                 created_at DATETIME,
                 indexed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                tagged_at DATETIME
+                tagged_at DATETIME,
+                rating INTEGER NOT NULL DEFAULT 5, -- see RATING_ORDER_SQL
+                aspect_class TEXT GENERATED ALWAYS AS ({ASPECT_CLASS_SQL}) VIRTUAL
             )
         """)
         
         # Schema Migration: Add checkpoint and loras columns if they don't exist
-        cursor.execute("PRAGMA table_info(images)")
-        columns = [row[1] for row in cursor.fetchall()]
-        if 'checkpoint' not in columns:
-            cursor.execute("ALTER TABLE images ADD COLUMN checkpoint TEXT")
-        if 'loras' not in columns:
-            cursor.execute("ALTER TABLE images ADD COLUMN loras TEXT")
+        if schema_version < 1:
+            cursor.execute("PRAGMA table_info(images)")
+            columns = [row[1] for row in cursor.fetchall()]
+            if 'checkpoint' not in columns:
+                cursor.execute("ALTER TABLE images ADD COLUMN checkpoint TEXT")
+            if 'loras' not in columns:
+                cursor.execute("ALTER TABLE images ADD COLUMN loras TEXT")
+        
+        if schema_version < 3:
+            cursor.execute("PRAGMA table_info(images)")
+            if 'rating' not in [row[1] for row in cursor.fetchall()]:
+                cursor.execute("ALTER TABLE images ADD COLUMN rating INTEGER NOT NULL DEFAULT 5")
+                backfill_rating = True
+            else:
+                backfill_rating = False
+        
+        if schema_version < 6:
+            # Generated columns are hidden from table_info; table_xinfo lists them.
+            # ALTER TABLE can only add VIRTUAL (not STORED) generated columns.
+            cursor.execute("PRAGMA table_xinfo(images)")
+            if 'aspect_class' not in [row[1] for row in cursor.fetchall()]:
+                cursor.execute(
+                    f"ALTER TABLE images ADD COLUMN aspect_class TEXT GENERATED ALWAYS AS ({ASPECT_CLASS_SQL}) VIRTUAL"
+                )
         
         # Tags table
         cursor.execute("""
@@ -185,13 +443,308 @@ def init_db():
             )
         """)
         
+        # Normalized LORA names per image (see extract_lora_names), so LORA
+        # filters are index lookups instead of LIKE scans over loras/prompt
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'image_loras'")
+        backfill_loras = cursor.fetchone() is None
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS image_loras (
+                image_id INTEGER NOT NULL,
+                lora TEXT NOT NULL,
+                PRIMARY KEY (image_id, lora),
+                FOREIGN KEY (image_id) REFERENCES images(id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        """)
+        if backfill_loras:
+            cursor.execute("SELECT id, loras, prompt FROM images WHERE loras IS NOT NULL OR prompt LIKE '%<lora:%'")
+            cursor.executemany(
+                "INSERT OR IGNORE INTO image_loras (image_id, lora) VALUES (?, ?)",
+                [
+                    (row["id"], lora)
+                    for row in cursor.fetchall()
+                    for lora in extract_lora_names(row["loras"], row["prompt"])
+                ]
+            )
+        
+        # Normalized prompt tokens per image (see extract_prompt_tokens), so the
+        # exact-token prompt filter is an index lookup instead of re-parsing
+        # every candidate prompt in Python
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'image_prompt_tokens'")
+        backfill_prompt_tokens = cursor.fetchone() is None
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS image_prompt_tokens (
+                image_id INTEGER NOT NULL,
+                token TEXT NOT NULL,
+                PRIMARY KEY (image_id, token),
+                FOREIGN KEY (image_id) REFERENCES images(id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        """)
+        if backfill_prompt_tokens:
+            cursor.execute("SELECT id, prompt FROM images WHERE prompt IS NOT NULL AND prompt != ''")
+            cursor.executemany(
+                _SQL_INSERT_IMAGE_PROMPT_TOKEN,
+                [(row["id"], token) for row in cursor.fetchall() for token in extract_prompt_tokens(row["prompt"])]
+            )
+        
+        # images.rating caches the image's strongest rating tag for the
+        # rating sort; triggers on tags keep it current for every writer
+        rating_of_image = f"""
+            (SELECT COALESCE(MIN({RATING_ORDER_SQL}), 5) FROM tags
+             WHERE tags.image_id = images.id AND tag IN {RATING_TAGS_SQL})
+        """
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS tags_rating_ai AFTER INSERT ON tags
+            WHEN new.tag IN {RATING_TAGS_SQL} BEGIN
+                UPDATE images SET rating = {rating_of_image} WHERE id = new.image_id;
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS tags_rating_ad AFTER DELETE ON tags
+            WHEN old.tag IN {RATING_TAGS_SQL} BEGIN
+                UPDATE images SET rating = {rating_of_image} WHERE id = old.image_id;
+            END
+        """)
+        if schema_version < 3 and backfill_rating:
+            cursor.execute(f"UPDATE images SET rating = {rating_of_image} WHERE tagged_at IS NOT NULL")
+        
+        # Row counts kept current by triggers, so count badges read one row
+        # instead of walking the whole images table
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'counters'")
+        backfill_counters = cursor.fetchone() is None
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS images_count_ai AFTER INSERT ON images BEGIN
+                UPDATE counters SET value = value + 1 WHERE name = 'images';
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS images_count_ad AFTER DELETE ON images BEGIN
+                UPDATE counters SET value = value - 1 WHERE name = 'images';
+            END
+        """)
+        if backfill_counters:
+            cursor.execute("INSERT INTO counters (name, value) SELECT 'images', COUNT(*) FROM images")
+        
+        # Substring search index over normalized prompt and filename.
+        # The trigram tokenizer keeps LIKE '%term%' semantics (case-insensitive)
+        # while looking terms up by index; triggers keep it in sync.
+        global FTS_AVAILABLE
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'images_fts'")
+        backfill_fts = cursor.fetchone() is None
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS images_fts
+                USING fts5(prompt, filename, tokenize='trigram')
+            """)
+            FTS_AVAILABLE = True
+        except sqlite3.OperationalError as e:
+            print(f"FTS5 trigram search unavailable, using LIKE scans: {e}")
+            FTS_AVAILABLE = False
+        
+        if FTS_AVAILABLE:
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS images_fts_ai AFTER INSERT ON images BEGIN
+                    INSERT INTO images_fts (rowid, prompt, filename)
+                    VALUES (new.id, REPLACE(LOWER(COALESCE(new.prompt, '')), '_', ' '), new.filename);
+                END
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS images_fts_ad AFTER DELETE ON images BEGIN
+                    DELETE FROM images_fts WHERE rowid = old.id;
+                END
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS images_fts_au AFTER UPDATE OF prompt, filename ON images BEGIN
+                    UPDATE images_fts
+                    SET prompt = REPLACE(LOWER(COALESCE(new.prompt, '')), '_', ' '), filename = new.filename
+                    WHERE rowid = new.id;
+                END
+            """)
+            if backfill_fts:
+                cursor.execute("""
+                    INSERT INTO images_fts (rowid, prompt, filename)
+                    SELECT id, REPLACE(LOWER(COALESCE(prompt, '')), '_', ' '), filename FROM images
+                """)
+        
         # Create indexes for fast searching
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_tags_tag ON tags(tag)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tags_image_id ON tags(image_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_generator ON images(generator)")
+        # (image_id, tag) covers per-image tag lookups and EXISTS probes;
+        # it also serves every query the old image_id-only index did
+        # It is UNIQUE so add_tags can upsert; older databases may hold
+        # duplicate (image_id, tag) rows, of which the newest is kept
+        if schema_version < 4:
+            cursor.execute("DELETE FROM tags WHERE id NOT IN (SELECT MAX(id) FROM tags GROUP BY image_id, tag)")
+            cursor.execute("DROP INDEX IF EXISTS idx_tags_image_tag")
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_tags_image_tag ON tags(image_id, tag)")
+        cursor.execute("DROP INDEX IF EXISTS idx_tags_image_id")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_loras_lora ON image_loras(lora)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_prompt_tokens_token ON image_prompt_tokens(token)")
+        # Sort-key indexes let ORDER BY ... LIMIT stream rows in order instead
+        # of sorting the whole table; (generator, created_at) serves the
+        # generator sort and generator filters, replacing idx_images_generator
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_images_generator_created ON images(generator, created_at DESC)"
+        )
+        cursor.execute("DROP INDEX IF EXISTS idx_images_generator")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_filename ON images(filename)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_file_size ON images(file_size)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_path ON images(path)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_tagged_at ON images(tagged_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_created_at ON images(created_at DESC)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_rating ON images(rating)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_aspect_class ON images(aspect_class)")
+        # Partial index covering only the tagging queue, so popping untagged
+        # images stays cheap however much of the library is already tagged
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_images_untagged ON images(indexed_at, id) WHERE tagged_at IS NULL"
+        )
         
-        conn.commit()
+        if schema_version < SCHEMA_VERSION:
+            # Refresh planner statistics for any indexes just added
+            cursor.execute("ANALYZE")
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+# Fixed statements for the single-purpose helpers below. Each connection
+# keeps prepared statements keyed by SQL text (cached_statements), and
+# with the per-thread connections these are prepared once per thread.
+# Upsert rather than INSERT OR REPLACE: REPLACE deletes the old row first,
+# which cascades away its tags and hands the image a new id on every re-scan.
+_SQL_UPSERT_IMAGE = """
+    INSERT INTO images 
+    (path, filename, generator, prompt, negative_prompt, metadata_json, 
+     width, height, file_size, checkpoint, loras, created_at, indexed_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(path) DO UPDATE SET
+        filename = excluded.filename,
+        generator = excluded.generator,
+        prompt = excluded.prompt,
+        negative_prompt = excluded.negative_prompt,
+        metadata_json = excluded.metadata_json,
+        width = excluded.width,
+        height = excluded.height,
+        file_size = excluded.file_size,
+        checkpoint = excluded.checkpoint,
+        loras = excluded.loras,
+        created_at = excluded.created_at,
+        indexed_at = CURRENT_TIMESTAMP
+"""
+_SQL_INSERT_IMAGE = _SQL_UPSERT_IMAGE + "    RETURNING id\n"
+_SQL_GET_IDS_BY_PATH = "SELECT path, id FROM images WHERE path IN (SELECT value FROM json_each(?))"
+_SQL_DELETE_IMAGE_LORAS = "DELETE FROM image_loras WHERE image_id = ?"
+_SQL_INSERT_IMAGE_LORA = "INSERT OR IGNORE INTO image_loras (image_id, lora) VALUES (?, ?)"
+_SQL_DELETE_IMAGE_PROMPT_TOKENS = "DELETE FROM image_prompt_tokens WHERE image_id = ?"
+_SQL_INSERT_IMAGE_PROMPT_TOKEN = "INSERT OR IGNORE INTO image_prompt_tokens (image_id, token) VALUES (?, ?)"
+_SQL_DELETE_STALE_IMAGE_TAGS = """
+    DELETE FROM tags WHERE image_id = ? AND tag NOT IN (SELECT value FROM json_each(?))
+"""
+_SQL_UPSERT_TAG = """
+    INSERT INTO tags (image_id, tag, confidence) VALUES (?, ?, ?)
+    ON CONFLICT(image_id, tag) DO UPDATE SET confidence = excluded.confidence
+    WHERE confidence IS NOT excluded.confidence
+"""
+_SQL_MARK_TAGGED = "UPDATE images SET tagged_at = CURRENT_TIMESTAMP WHERE id = ?"
+_SQL_GET_IMAGE_BY_ID = "SELECT * FROM images WHERE id = ?"
+_SQL_GET_IMAGE_TAGS = "SELECT tag, confidence FROM tags WHERE image_id = ? ORDER BY confidence DESC"
+_SQL_GET_ALL_TAGS = """
+    SELECT tag, COUNT(*) as count 
+    FROM tags 
+    GROUP BY tag 
+    ORDER BY count DESC
+"""
+_SQL_GET_ALL_GENERATORS = """
+    SELECT generator, COUNT(*) as count 
+    FROM images 
+    GROUP BY generator 
+    ORDER BY count DESC
+"""
+_SQL_GET_ALL_LORAS = """
+    SELECT lora, COUNT(*) as count
+    FROM image_loras
+    GROUP BY lora
+    ORDER BY count DESC, lora
+"""
+_SQL_GET_ALL_PROMPT_TOKENS = """
+    SELECT token as prompt, COUNT(*) as count
+    FROM image_prompt_tokens
+    GROUP BY token
+    ORDER BY count DESC, token
+"""
+_SQL_COUNT_UNTAGGED = "SELECT COUNT(*) FROM images WHERE tagged_at IS NULL"
+_SQL_UPDATE_IMAGE_PATH = "UPDATE images SET path = ?, filename = ? WHERE id = ?"
+_SQL_DELETE_IMAGE = "DELETE FROM images WHERE id = ?"
+_SQL_COUNT_IMAGES = "SELECT value FROM counters WHERE name = 'images'"
+
+# The unfiltered random sort draws this many candidate ids per wanted row,
+# so a few deleted ids don't leave the page short
+RANDOM_SAMPLE_FACTOR = 2
+
+# Sorts that can page by keyset (get_images' after=): sort column, its
+# direction, and the direction of the id tiebreaker. An index holds rows
+# in rowid order within each key, so a DESC index reads ids ascending;
+# matching that lets SQLite walk the index without a separate sort.
+KEYSET_SORTS = {
+    "newest": ("created_at", "DESC", "ASC"),
+    "oldest": ("created_at", "ASC", "DESC"),
+    "name_asc": ("filename", "ASC", "ASC"),
+    "name_desc": ("filename", "DESC", "DESC"),
+    "rating": ("rating", "ASC", "ASC"),
+    "file_size": ("file_size", "DESC", "DESC"),
+    "file_size_asc": ("file_size", "ASC", "ASC"),
+}
+
+
+def _keyset_ranges(sort_by: str, after: tuple) -> List[tuple]:
+    """WHERE fragments, with params, for the rows that sort after (key, id).
+    
+    Each fragment is one contiguous stretch of the sort order and an index
+    range SQLite can seek into; together, in order, they cover the rest of
+    the results. NULL keys sort first ascending and last descending, so
+    they are a stretch of their own.
+    """
+    column, direction, id_direction = KEYSET_SORTS[sort_by]
+    key, last_id = after
+    column = f"i.{column}"
+    id_past = "<" if id_direction == "DESC" else ">"
+    if key is None:
+        nulls = (f"{column} IS NULL AND i.id {id_past} ?", [last_id])
+        return [nulls] if direction == "DESC" else [nulls, (f"{column} IS NOT NULL", [])]
+    bound, past = ("<=", "<") if direction == "DESC" else (">=", ">")
+    rest = (f"{column} {bound} ? AND ({column} {past} ? OR i.id {id_past} ?)", [key, key, last_id])
+    return [rest, (f"{column} IS NULL", [])] if direction == "DESC" else [rest]
+
+
+def keyset_after(row: Dict[str, Any], sort_by: str) -> tuple:
+    """The (key, id) position of a get_images row, to pass back as after=.
+    
+    The row must include the sort column (the default fields do).
+    """
+    column = "rating_order" if sort_by == "rating" else KEYSET_SORTS[sort_by][0]
+    return (row[column], row["id"])
+
+
+@lru_cache(maxsize=1024)
+def _encode_lora_tuple(loras: tuple) -> str:
+    return json.dumps(list(loras))
+
+
+def encode_loras(loras: Optional[List[str]]) -> Optional[str]:
+    """JSON-encode a loras list for the images.loras column (None if empty).
+    
+    Scans often repeat the same LORA combination, so encodings are memoized.
+    """
+    if not loras:
+        return None
+    try:
+        return _encode_lora_tuple(tuple(loras))
+    except TypeError:
+        # Unhashable entries (e.g. a ComfyUI link list) can't be memo keys
+        return json.dumps(loras)
 
 
 def add_image(
@@ -206,41 +759,135 @@ def add_image(
     file_size: Optional[int] = None,
     checkpoint: Optional[str] = None,
     loras: Optional[List[str]] = None,
-    created_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None,
+    loras_json: Optional[str] = None
 ) -> int:
-    """Add an image to the database. Returns the image ID."""
-    with get_db() as conn:
+    """Add an image to the database. Returns the image ID.
+    
+    Pass loras_json to store an already-encoded loras list as-is;
+    otherwise loras is encoded here.
+    """
+    if loras_json is None:
+        loras_json = encode_loras(loras)
+    with get_db(immediate=True) as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT OR REPLACE INTO images 
-            (path, filename, generator, prompt, negative_prompt, metadata_json, 
-             width, height, file_size, checkpoint, loras, created_at, indexed_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        """, (path, filename, generator, prompt, negative_prompt, metadata_json,
-              width, height, file_size, checkpoint, json.dumps(loras) if loras else None, created_at))
-        return cursor.lastrowid
+        cursor.execute(_SQL_INSERT_IMAGE, (path, filename, generator, prompt, negative_prompt, metadata_json,
+              width, height, file_size, checkpoint, loras_json, created_at))
+        # lastrowid is not reliable when the upsert takes the UPDATE branch
+        image_id = cursor.fetchone()[0]
+        
+        cursor.execute(_SQL_DELETE_IMAGE_LORAS, (image_id,))
+        cursor.executemany(
+            _SQL_INSERT_IMAGE_LORA,
+            [(image_id, lora) for lora in extract_lora_names(loras_json, prompt)]
+        )
+        cursor.execute(_SQL_DELETE_IMAGE_PROMPT_TOKENS, (image_id,))
+        cursor.executemany(
+            _SQL_INSERT_IMAGE_PROMPT_TOKEN,
+            [(image_id, token) for token in extract_prompt_tokens(prompt)]
+        )
+    invalidate_reference_cache()
+    return image_id
+
+
+BULK_INSERT_BATCH_SIZE = 1000
+# Re-ANALYZE after this many bulk-inserted rows so the planner's statistics
+# keep up with a large first scan
+BULK_ANALYZE_EVERY = 10000
+
+
+def add_images_bulk(images: Iterable[Dict[str, Any]], batch_size: int = BULK_INSERT_BATCH_SIZE) -> List[int]:
+    """Add many images, committing once per batch instead of once per image.
+    
+    Each item holds the keyword arguments of add_image. Returns the image IDs
+    in input order.
+    """
+    ids = []
+    images = iter(images)
+    rows_since_analyze = 0
+    while True:
+        batch = list(islice(images, batch_size))
+        if not batch:
+            return ids
+        rows = []
+        lora_names = []
+        prompt_tokens = []
+        for image in batch:
+            loras_json = image.get("loras_json")
+            if loras_json is None:
+                loras_json = encode_loras(image.get("loras"))
+            prompt = image.get("prompt")
+            rows.append((
+                image["path"], image["filename"], image.get("generator", "unknown"), prompt,
+                image.get("negative_prompt"), image.get("metadata_json"), image.get("width"),
+                image.get("height"), image.get("file_size"), image.get("checkpoint"),
+                loras_json, image.get("created_at"),
+            ))
+            lora_names.append(extract_lora_names(loras_json, prompt))
+            prompt_tokens.append(extract_prompt_tokens(prompt))
+        
+        with get_db(immediate=True) as conn:
+            cursor = conn.cursor()
+            cursor.executemany(_SQL_UPSERT_IMAGE, rows)
+            paths = [row[0] for row in rows]
+            id_by_path = dict(cursor.execute(_SQL_GET_IDS_BY_PATH, (json.dumps(paths),)).fetchall())
+            batch_ids = [id_by_path[path] for path in paths]
+            cursor.executemany(_SQL_DELETE_IMAGE_LORAS, [(image_id,) for image_id in batch_ids])
+            cursor.executemany(
+                _SQL_INSERT_IMAGE_LORA,
+                [(image_id, lora) for image_id, names in zip(batch_ids, lora_names) for lora in names]
+            )
+            cursor.executemany(_SQL_DELETE_IMAGE_PROMPT_TOKENS, [(image_id,) for image_id in batch_ids])
+            cursor.executemany(
+                _SQL_INSERT_IMAGE_PROMPT_TOKEN,
+                [(image_id, token) for image_id, tokens in zip(batch_ids, prompt_tokens) for token in tokens]
+            )
+        ids.extend(batch_ids)
+        invalidate_reference_cache()
+        
+        rows_since_analyze += len(batch)
+        if rows_since_analyze >= BULK_ANALYZE_EVERY:
+            analyze_db()
+            rows_since_analyze = 0
+
+
+def analyze_db():
+    """Refresh the query planner's statistics (sqlite_stat1)."""
+    with get_db(immediate=True) as conn:
+        conn.execute("ANALYZE")
+
+
+def _write_tags(cursor: sqlite3.Cursor, image_id: int, tags: List[Dict[str, Any]]):
+    """Replace an image's tags and mark it tagged, inside the caller's transaction."""
+    rows = [
+        (image_id, tag_data["tag"], tag_data.get("confidence", 1.0))
+        for tag_data in tags if tag_data.get("tag")
+    ]
+    # Drop tags that are no longer present, then upsert the rest; tags
+    # whose confidence is unchanged are left untouched
+    cursor.execute(_SQL_DELETE_STALE_IMAGE_TAGS, (image_id, json.dumps([row[1] for row in rows])))
+    cursor.executemany(_SQL_UPSERT_TAG, rows)
+    # Update tagged timestamp
+    cursor.execute(_SQL_MARK_TAGGED, (image_id,))
 
 
 def add_tags(image_id: int, tags: List[Dict[str, Any]]):
     """Add tags for an image. Each tag dict should have 'tag' and optionally 'confidence'."""
-    with get_db() as conn:
+    with get_db(immediate=True) as conn:
+        _write_tags(conn.cursor(), image_id, tags)
+    invalidate_reference_cache()
+
+
+def add_tags_bulk(tagged: Iterable[tuple]):
+    """Add tags for several images in one transaction.
+    
+    tagged yields (image_id, tags) pairs, with tags as for add_tags().
+    """
+    with get_db(immediate=True) as conn:
         cursor = conn.cursor()
-        # Clear existing tags
-        cursor.execute("DELETE FROM tags WHERE image_id = ?", (image_id,))
-        # Add new tags
-        for tag_data in tags:
-            tag = tag_data.get("tag", "")
-            confidence = tag_data.get("confidence", 1.0)
-            if tag:
-                cursor.execute(
-                    "INSERT INTO tags (image_id, tag, confidence) VALUES (?, ?, ?)",
-                    (image_id, tag, confidence)
-                )
-        # Update tagged timestamp
-        cursor.execute(
-            "UPDATE images SET tagged_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (image_id,)
-        )
+        for image_id, tags in tagged:
+            _write_tags(cursor, image_id, tags)
+    invalidate_reference_cache()
 
 
 def get_images(
@@ -258,7 +905,10 @@ def get_images(
     min_height: Optional[int] = None,
     max_height: Optional[int] = None,
     prompt_terms: Optional[List[str]] = None,  # Multi-prompt filter (AND logic)
-    aspect_ratio: Optional[str] = None  # 'square', 'landscape', 'portrait'
+    aspect_ratio: Optional[str] = None,  # 'square', 'landscape', 'portrait'
+    with_total: bool = False,
+    fields: Optional[List[str]] = None,
+    after: Optional[tuple] = None
 ) -> List[Dict[str, Any]]:
     """
     Get images with optional filters.
@@ -266,53 +916,85 @@ def get_images(
     - tags: Filter by tags (AND logic - image must have ALL tags)
     - ratings: Filter by rating tags (OR logic - image must have ANY rating OR be untagged)
     - checkpoints: Filter by checkpoint names (OR logic)
-    - loras: Filter by lora names (AND logic - image must have ALL loras)
+    - loras: Filter by lora names (OR logic - image must have ANY of the loras)
     - search_query: Search in prompt text
     - sort_by: Sorting method (newest, oldest, name_asc, name_desc, generator, prompt_length, tag_count, rating, character_count, random, file_size)
     - min_width, max_width, min_height, max_height: Dimension filters
     - aspect_ratio: Filter by aspect ratio ('square', 'landscape', 'portrait')
+    - with_total: Add 'total_rows' (matches before limit/offset) to every row
+    - fields: Image columns to return (default IMAGE_LIST_FIELDS)
+    - after: Keyset position (see keyset_after) to continue from instead of
+      counting off offset rows; only for sorts in KEYSET_SORTS, and not
+      combined with offset or with_total
     """
-    with get_db() as conn:
+    if after is not None and (sort_by not in KEYSET_SORTS or offset or with_total):
+        raise ValueError(f"Keyset paging needs a sort in KEYSET_SORTS, no offset and no total (got {sort_by!r})")
+    
+    # Total for pagination from the same query via a window count
+    total_column = ", COUNT(*) OVER () as total_rows" if with_total else ""
+    select_list = image_select_list(list(fields or IMAGE_LIST_FIELDS), "i.")
+    
+    with read_db() as conn:
         cursor = conn.cursor()
         
-        # Base query - add subqueries for tag-based sorting
+        # Base query - tag-based sorts join a per-image aggregate over tags,
+        # computed in one grouped pass rather than a subquery per image row.
+        # Every join yields at most one row per image, so no DISTINCT is needed.
         if sort_by == "tag_count":
-            query = """SELECT DISTINCT i.*, 
-                       (SELECT COUNT(*) FROM tags t WHERE t.image_id = i.id) as tag_count 
-                       FROM images i"""
+            query = f"""SELECT {select_list}{total_column}, COALESCE(tc.tag_count, 0) as tag_count
+                       FROM images i
+                       LEFT JOIN (
+                           SELECT image_id, COUNT(*) as tag_count FROM tags GROUP BY image_id
+                       ) tc ON tc.image_id = i.id"""
         elif sort_by == "character_count":
-            query = """SELECT DISTINCT i.*, 
-                       (SELECT COUNT(*) FROM tags t WHERE t.image_id = i.id AND t.tag LIKE '%character%') as char_count 
-                       FROM images i"""
+            query = f"""SELECT {select_list}{total_column}, COALESCE(cc.char_count, 0) as char_count
+                       FROM images i
+                       LEFT JOIN (
+                           SELECT image_id, COUNT(*) as char_count FROM tags
+                           WHERE tag LIKE '%character%' GROUP BY image_id
+                       ) cc ON cc.image_id = i.id"""
         elif sort_by == "rating":
-            # Priority: explicit > questionable > sensitive > general > unrated
-            query = """SELECT DISTINCT i.*, 
-                       CASE 
-                           WHEN EXISTS (SELECT 1 FROM tags t WHERE t.image_id = i.id AND t.tag = 'explicit') THEN 1
-                           WHEN EXISTS (SELECT 1 FROM tags t WHERE t.image_id = i.id AND t.tag = 'questionable') THEN 2
-                           WHEN EXISTS (SELECT 1 FROM tags t WHERE t.image_id = i.id AND t.tag = 'sensitive') THEN 3
-                           WHEN EXISTS (SELECT 1 FROM tags t WHERE t.image_id = i.id AND t.tag = 'general') THEN 4
-                           ELSE 5
-                       END as rating_order
-                       FROM images i"""
+            # Priority: explicit > questionable > sensitive > general > unrated,
+            # precomputed in images.rating
+            query = f"SELECT {select_list}{total_column}, i.rating as rating_order FROM images i"
         else:
-            query = "SELECT DISTINCT i.* FROM images i"
+            query = f"SELECT {select_list}{total_column} FROM images i"
         
         conditions = []
         params = []
         
-        # Join with tags if filtering by tags (AND logic)
+        # List-valued filters are passed as one JSON array parameter and
+        # expanded with json_each(), so the SQL text doesn't change with the
+        # number of selected values and stays in the statement cache.
+        
+        # Filter by tags (AND logic): one grouped pass over the matching tags
+        # instead of a self-join per tag. Each term must match at least one of
+        # the image's tags (a single tag may satisfy several terms), i.e. the
+        # number of distinct terms matched equals the number of terms. The
+        # LIKE patterns are matched against the distinct tag vocabulary first,
+        # then the hits are joined back through the tag index.
         if tags:
-            for i, tag in enumerate(tags):
-                alias = f"t{i}"
-                query += f" INNER JOIN tags {alias} ON i.id = {alias}.image_id AND {alias}.tag LIKE ?"
-                params.append(f"%{tag}%")
+            tags_json = json.dumps(tags)
+            conditions.append("""i.id IN (
+                WITH term AS MATERIALIZED (
+                    SELECT key, '%' || value || '%' AS pattern FROM json_each(?)
+                ),
+                matched AS MATERIALIZED (
+                    SELECT vocab.tag, term.key
+                    FROM (SELECT DISTINCT tag FROM tags) vocab
+                    JOIN term ON vocab.tag LIKE term.pattern
+                )
+                SELECT t.image_id FROM matched
+                JOIN tags t ON t.tag = matched.tag
+                GROUP BY t.image_id
+                HAVING COUNT(DISTINCT matched.key) = json_array_length(?)
+            )""")
+            params.extend([tags_json, tags_json])
         
         # Filter by generators
         if generators:
-            placeholders = ",".join("?" * len(generators))
-            conditions.append(f"i.generator IN ({placeholders})")
-            params.extend(generators)
+            conditions.append("i.generator IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(generators))
         
         # Filter by ratings (OR logic)
         # When all 4 ratings are selected, don't filter at all (show everything)
@@ -322,50 +1004,60 @@ def get_images(
             selected_ratings = set(ratings)
             # Only apply filter if not all ratings are selected
             if selected_ratings != all_ratings:
-                rating_placeholders = ",".join("?" * len(ratings))
                 # Image has one of the selected ratings OR image has no tags at all (untagged)
-                conditions.append(f"""(
-                    EXISTS (SELECT 1 FROM tags rt WHERE rt.image_id = i.id AND rt.tag IN ({rating_placeholders}))
+                conditions.append("""(
+                    EXISTS (
+                        SELECT 1 FROM tags rt
+                        WHERE rt.image_id = i.id AND rt.tag IN (SELECT value FROM json_each(?))
+                    )
                     OR i.tagged_at IS NULL
                 )""")
-                params.extend(ratings)
+                params.append(json.dumps(ratings))
         
         # Filter by checkpoints (OR logic)
         if checkpoints:
-            placeholders = ",".join("?" * len(checkpoints))
-            conditions.append(f"i.checkpoint IN ({placeholders})")
-            params.extend(checkpoints)
+            conditions.append("i.checkpoint IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(checkpoints))
             
         # Filter by loras (OR logic - image has ANY of the selected loras)
-        # Match on lora name in loras column, metadata_json, or prompt
-        # Use same normalization as library: strip weight notation and lowercase
+        # Exact match on the normalized names in image_loras, which use the
+        # same normalization as the library: no weight notation, lowercase
         if loras:
-            lora_conditions = []
-            for lora in loras:
-                # Strip weight notation (name:0.8 -> name) and lowercase
-                lora_normalized = normalize_lora_name(lora)
-                # Match lora name in loras column, metadata_json, or prompt
-                lora_conditions.append("(LOWER(i.loras) LIKE ? OR LOWER(i.metadata_json) LIKE ? OR LOWER(i.prompt) LIKE ?)")
-                params.append(f"%{lora_normalized}%")
-                params.append(f"%{lora_normalized}%")
-                params.append(f"%{lora_normalized}%")
-            conditions.append(f"({' OR '.join(lora_conditions)})")
+            normalized_loras = [normalize_lora_name(lora) for lora in loras]
+            conditions.append(
+                "i.id IN (SELECT image_id FROM image_loras WHERE lora IN (SELECT value FROM json_each(?)))"
+            )
+            params.append(json.dumps(normalized_loras))
         
         # Search in prompt (full-text single term) - with normalization
         # Normalize: lowercase and replace underscore with space
         if search_query:
             normalized_search = normalize_prompt_token(search_query)
-            conditions.append("(REPLACE(LOWER(i.prompt), '_', ' ') LIKE ? OR LOWER(i.filename) LIKE ?)")
-            params.extend([f"%{normalized_search}%", f"%{search_query.lower()}%"])
+            filename_search = search_query.lower()
+            if FTS_AVAILABLE and min(len(normalized_search), len(filename_search)) >= FTS_MIN_QUERY_LENGTH:
+                conditions.append("i.id IN (SELECT rowid FROM images_fts WHERE images_fts MATCH ?)")
+                params.append(
+                    f"prompt : {fts_phrase(normalized_search)} OR filename : {fts_phrase(filename_search)}"
+                )
+            else:
+                conditions.append("(REPLACE(LOWER(i.prompt), '_', ' ') LIKE ? OR LOWER(i.filename) LIKE ?)")
+                params.extend([f"%{normalized_search}%", f"%{filename_search}%"])
         
         # Multi-prompt filter (AND logic - prompt must contain ALL terms)
-        # Uses substring matching (LIKE %term%) with normalization
-        # Library counting will use the same logic for consistency
+        # Exact match on the normalized comma-separated tokens stored in
+        # image_prompt_tokens, the same tokens the prompt library counts.
+        # Driving the join from the materialized terms keeps the planner on
+        # the token index rather than scanning the whole table in image order.
         if prompt_terms:
-            for term in prompt_terms:
-                normalized_term = normalize_prompt_token(term)
-                conditions.append("REPLACE(LOWER(i.prompt), '_', ' ') LIKE ?")
-                params.append(f"%{normalized_term}%")
+            normalized_terms = sorted({normalize_prompt_token(term) for term in prompt_terms})
+            conditions.append("""i.id IN (
+                WITH term AS MATERIALIZED (SELECT value FROM json_each(?))
+                SELECT pt.image_id FROM term
+                JOIN image_prompt_tokens pt ON pt.token = term.value
+                GROUP BY pt.image_id
+                HAVING COUNT(*) = ?
+            )""")
+            params.extend([json.dumps(normalized_terms), len(normalized_terms)])
         
         # Dimension filters
         if min_width:
@@ -381,17 +1073,14 @@ def get_images(
             conditions.append("i.height <= ?")
             params.append(max_height)
         
-        # Aspect ratio filter
-        if aspect_ratio:
-            if aspect_ratio == 'square':
-                conditions.append("ABS(CAST(i.width AS FLOAT) / i.height - 1.0) < 0.1")
-            elif aspect_ratio == 'landscape':
-                conditions.append("CAST(i.width AS FLOAT) / i.height > 1.1")
-            elif aspect_ratio == 'portrait':
-                conditions.append("CAST(i.width AS FLOAT) / i.height < 0.9")
+        # Aspect ratio filter (see ASPECT_CLASS_SQL)
+        if aspect_ratio in ASPECT_CLASSES:
+            conditions.append("i.aspect_class = ?")
+            params.append(aspect_ratio)
         
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
+        base_query = query
+        where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+        query += where_clause
         
         # Sorting
         sort_options = {
@@ -402,141 +1091,287 @@ def get_images(
             "generator": "i.generator ASC, i.created_at DESC",
             "prompt_length": "LENGTH(COALESCE(i.prompt, '')) DESC",
             "tag_count": "tag_count DESC",
-            "rating": "rating_order ASC",
+            "rating": "i.rating ASC",
             "character_count": "char_count DESC",
             "random": "RANDOM()",
             "file_size": "i.file_size DESC",
             "file_size_asc": "i.file_size ASC"
         }
         order_clause = sort_options.get(sort_by, "i.created_at DESC")
+        if sort_by in KEYSET_SORTS:
+            # The id tiebreaker makes the order total, so keyset pages neither
+            # skip nor repeat rows that share a key
+            order_clause += f", i.id {KEYSET_SORTS[sort_by][2]}"
         
-        # For exact matching filters, we fetch more than needed and post-filter
-        # This ensures exact token/LORA matching consistency with library counting
-        needs_post_filter = bool(prompt_terms) or bool(loras)
+        if after is not None:
+            # Keyset paging: continue after the last row of the previous page
+            rows = []
+            for condition, range_params in _keyset_ranges(sort_by, after):
+                cursor.execute(
+                    f"{base_query} WHERE {' AND '.join(conditions + [condition])} ORDER BY {order_clause} LIMIT ?",
+                    params + range_params + [limit - len(rows)]
+                )
+                rows.extend(fetch_dicts(cursor))
+                if len(rows) >= limit:
+                    break
+            return rows
+        
+        if sort_by == "random" and not conditions:
+            # Unfiltered: draw random ids and fetch them by primary key instead
+            # of shuffling the whole table. Falls through to the shuffle below
+            # if deleted ids leave the draw short.
+            total = cursor.execute(_SQL_COUNT_IMAGES).fetchone()[0]
+            wanted = min(limit, max(total - offset, 0))
+            max_id = cursor.execute("SELECT MAX(id) FROM images").fetchone()[0] or 0
+            ids = random.sample(range(1, max_id + 1), min(max_id, wanted * RANDOM_SAMPLE_FACTOR))
+            cursor.execute(
+                f"""SELECT {select_list}{", ? as total_rows" if with_total else ""}
+                    FROM json_each(?) picked
+                    JOIN images i ON i.id = picked.value
+                    ORDER BY picked.key LIMIT ?""",
+                ([total] if with_total else []) + [json.dumps(ids), wanted]
+            )
+            rows = fetch_dicts(cursor)
+            if len(rows) == wanted:
+                return rows
         
-        if needs_post_filter:
-            # Fetch all candidates without limit (we'll apply limit after post-filtering)
-            query += f" ORDER BY {order_clause}"
+        if sort_by == "random":
+            # Shuffle just the filtered ids and fetch the picked rows by key,
+            # rather than carrying every full row through the random sort
+            picked_total = ", COUNT(*) OVER () as total_rows" if with_total else ""
+            query = f"""SELECT {select_list}{", picked.total_rows" if with_total else ""}
+                       FROM (
+                           SELECT i.id{picked_total} FROM images i{where_clause}
+                           ORDER BY RANDOM() LIMIT ? OFFSET ?
+                       ) picked
+                       JOIN images i ON i.id = picked.id
+                       ORDER BY RANDOM()"""
+            params.extend([limit, offset])
         else:
             query += f" ORDER BY {order_clause} LIMIT ? OFFSET ?"
             params.extend([limit, offset])
         
         cursor.execute(query, params)
-        rows = cursor.fetchall()
-        results = [dict(row) for row in rows]
-        
-        # Post-filter for exact matching if needed
-        if needs_post_filter:
-            filtered_results = []
-            
-            # Normalize filter terms
-            normalized_prompt_terms = [normalize_prompt_token(t) for t in (prompt_terms or [])]
-            normalized_loras = [normalize_lora_name(l) for l in (loras or [])]
-            
-            for img in results:
-                # Check prompt tokens (AND logic - must have ALL terms)
-                if normalized_prompt_terms:
-                    image_tokens = extract_prompt_tokens(img.get('prompt', ''))
-                    if not all(term in image_tokens for term in normalized_prompt_terms):
-                        continue
-                
-                # Check LORAs (OR logic - must have ANY of the loras)
-                if normalized_loras:
-                    image_loras = extract_lora_names(img.get('loras', ''), img.get('prompt', ''))
-                    if not any(lora in image_loras for lora in normalized_loras):
-                        continue
-                
-                filtered_results.append(img)
-            
-            # Apply offset and limit after post-filtering
-            results = filtered_results[offset:offset + limit] if limit else filtered_results[offset:]
-        
-        return results
+        return fetch_dicts(cursor)
 
 
 
 def get_image_by_id(image_id: int) -> Optional[Dict[str, Any]]:
     """Get a single image by ID."""
-    with get_db() as conn:
+    with read_db() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM images WHERE id = ?", (image_id,))
+        cursor.execute(_SQL_GET_IMAGE_BY_ID, (image_id,))
         row = cursor.fetchone()
         return dict(row) if row else None
 
 
+def get_file_signatures() -> Dict[str, tuple]:
+    """Map each indexed path to its stored (created_at, file_size).
+    
+    created_at holds the file mtime from the last scan, so a rescan can
+    skip files whose signature is unchanged.
+    """
+    with read_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT path, created_at, file_size FROM images")
+        return {path: (created_at, file_size) for path, created_at, file_size in cursor}
+
+
 def get_image_tags(image_id: int) -> List[Dict[str, Any]]:
     """Get all tags for an image."""
-    with get_db() as conn:
+    with read_db() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            "SELECT tag, confidence FROM tags WHERE image_id = ? ORDER BY confidence DESC",
-            (image_id,)
-        )
-        return [dict(row) for row in cursor.fetchall()]
+        cursor.execute(_SQL_GET_IMAGE_TAGS, (image_id,))
+        return fetch_dicts(cursor)
 
 
-def get_all_tags() -> List[Dict[str, Any]]:
-    """Get all unique tags with their counts."""
-    with get_db() as conn:
+def get_tags_for_images(
+    image_ids: Iterable[int],
+    exclude: Optional[Iterable[str]] = None
+) -> Dict[int, Dict[str, Any]]:
+    """Get the filename and tag names of several images in one query.
+    
+    Returns {image_id: {"filename", "tags"}} for the ids that exist, tags in
+    descending confidence. Tags in exclude (matched case-insensitively)
+    are filtered out in SQL.
+    """
+    ids_json = json.dumps(list(dict.fromkeys(image_ids)))
+    exclude_json = json.dumps(sorted({tag.lower() for tag in exclude or ()}))
+    with read_db() as conn:
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT tag, COUNT(*) as count 
-            FROM tags 
-            GROUP BY tag 
-            ORDER BY count DESC
-        """)
-        return [dict(row) for row in cursor.fetchall()]
+            SELECT i.id, i.filename, t.tag
+            FROM json_each(?) picked
+            JOIN images i ON i.id = picked.value
+            LEFT JOIN tags t ON t.image_id = i.id
+                AND LOWER(t.tag) NOT IN (SELECT value FROM json_each(?))
+            ORDER BY i.id, t.confidence DESC
+        """, (ids_json, exclude_json))
+        result = {}
+        for (image_id, filename), rows in groupby(cursor, key=lambda row: (row[0], row[1])):
+            result[image_id] = {"filename": filename, "tags": [row[2] for row in rows if row[2] is not None]}
+        return result
+
+
+# Tag and generator summaries scan whole tables but only change on writes,
+# so they are cached until a write in this process calls
+# invalidate_reference_cache(), or the TTL runs out (covers other processes)
+REFERENCE_CACHE_TTL = 30.0
+_reference_cache = {}
+_reference_version = 0
+_reference_lock = threading.Lock()
+
+
+def invalidate_reference_cache():
+    """Drop cached tag/generator summaries; call after writing images or tags."""
+    global _reference_version
+    with _reference_lock:
+        _reference_version += 1
+        _reference_cache.clear()
+
+
+def _cached_reference(sql: str) -> List[Dict[str, Any]]:
+    """Run a summary query, reusing a recent result for the same database."""
+    with _reference_lock:
+        version = _reference_version
+        cached = _reference_cache.get(sql)
+    if cached and cached[0] == (DATABASE_PATH, version) and time.monotonic() - cached[1] < REFERENCE_CACHE_TTL:
+        return list(cached[2])
+    
+    with read_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql)
+        rows = fetch_dicts(cursor)
+    with _reference_lock:
+        # Skip storing if a write landed while the query ran
+        if _reference_version == version:
+            _reference_cache[sql] = ((DATABASE_PATH, version), time.monotonic(), rows)
+    return list(rows)
+
+
+def get_all_tags() -> List[Dict[str, Any]]:
+    """Get all unique tags with their counts."""
+    return _cached_reference(_SQL_GET_ALL_TAGS)
 
 
 def get_all_generators() -> List[Dict[str, Any]]:
     """Get all generators with their counts."""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT generator, COUNT(*) as count 
-            FROM images 
-            GROUP BY generator 
-            ORDER BY count DESC
-        """)
-        return [dict(row) for row in cursor.fetchall()]
+    return _cached_reference(_SQL_GET_ALL_GENERATORS)
+
+
+def get_all_prompt_tokens() -> List[Dict[str, Any]]:
+    """Get all normalized prompt tokens with the number of images using each.
+    
+    Counted from image_prompt_tokens, which holds the same tokens the prompt
+    filter matches (see extract_prompt_tokens).
+    """
+    return _cached_reference(_SQL_GET_ALL_PROMPT_TOKENS)
+
+
+def get_all_loras() -> List[Dict[str, Any]]:
+    """Get all normalized LORA names with the number of images using each.
+    
+    Counted from image_loras, which holds the same names the LORA filter
+    matches (see extract_lora_names).
+    """
+    return _cached_reference(_SQL_GET_ALL_LORAS)
+
+
+def iter_images(
+    untagged_only: bool = False,
+    fields: Optional[List[str]] = None,
+    batch_size: int = 256
+) -> Iterator[Dict[str, Any]]:
+    """Yield images in keyset order, reading batch_size rows at a time.
+    
+    Each batch is read by its own statement (keyset paging), so callers can
+    write to the database between rows without a read transaction being
+    held open; rows are not one consistent snapshot.
+    Images come in id order, or with untagged_only oldest-indexed first
+    (walking the idx_images_untagged partial index).
+    """
+    fields = list(fields or IMAGE_LIST_FIELDS)
+    order = ["indexed_at", "id"] if untagged_only else ["id"]
+    for field in order:
+        if field not in fields:
+            fields.append(field)
+    order_sql = ", ".join(order)
+    select = f"SELECT {image_select_list(fields)} FROM images"
+    where = " WHERE tagged_at IS NULL" if untagged_only else " WHERE 1"
+    first_query = f"{select}{where} ORDER BY {order_sql} LIMIT ?"
+    next_query = f"{select}{where} AND ({order_sql}) > ({', '.join('?' * len(order))}) ORDER BY {order_sql} LIMIT ?"
+    
+    query, params = first_query, ()
+    while True:
+        with read_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, (*params, batch_size))
+            rows = fetch_dicts(cursor)
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        query, params = next_query, tuple(rows[-1][field] for field in order)
 
 
 def get_untagged_images(limit: int = 100) -> List[Dict[str, Any]]:
     """Get images that haven't been tagged yet."""
-    with get_db() as conn:
+    return list(islice(iter_images(untagged_only=True, batch_size=min(limit, 256)), limit))
+
+
+def get_untagged_count() -> int:
+    """Get number of images that haven't been tagged yet."""
+    with read_db() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM images WHERE tagged_at IS NULL LIMIT ?",
-            (limit,)
-        )
-        return [dict(row) for row in cursor.fetchall()]
+        cursor.execute(_SQL_COUNT_UNTAGGED)
+        return cursor.fetchone()[0]
 
 
 def update_image_path(image_id: int, new_path: str):
     """Update the path of an image (after moving)."""
-    with get_db() as conn:
+    with get_db(immediate=True) as conn:
         cursor = conn.cursor()
         new_filename = os.path.basename(new_path)
-        cursor.execute(
-            "UPDATE images SET path = ?, filename = ? WHERE id = ?",
-            (new_path, new_filename, image_id)
-        )
+        cursor.execute(_SQL_UPDATE_IMAGE_PATH, (new_path, new_filename, image_id))
 
 
 def delete_image(image_id: int):
     """Delete an image from the database."""
-    with get_db() as conn:
+    with get_db(immediate=True) as conn:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM images WHERE id = ?", (image_id,))
+        cursor.execute(_SQL_DELETE_IMAGE, (image_id,))
+    invalidate_reference_cache()
+
+
+# Tables dropped by clear_all_images(), children before images
+_GALLERY_TABLES = ("tags", "image_loras", "image_prompt_tokens", "images_fts", "counters", "images")
+
+
+def clear_all_images():
+    """Delete every image along with its tags, LORA/token rows and search index.
+    
+    A plain DELETE FROM images walks every row, firing the search, counter
+    and rating triggers and cascading into tags per image. Dropping the
+    tables and recreating them empty just frees their pages. The images id
+    sequence is carried over so ids (and thumbnails cached by id) are not
+    reused.
+    """
+    with _schema_lock:
+        with get_db(immediate=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'images'")
+            row = cursor.fetchone()
+            for table in _GALLERY_TABLES:
+                cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            # Joins this transaction, so the clear is atomic
+            _create_schema()
+            if row is not None:
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('images', ?)", (row[0],))
+    invalidate_reference_cache()
 
 
 def get_image_count() -> int:
     """Get total number of images in database."""
-    with get_db() as conn:
+    with read_db() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM images")
+        cursor.execute(_SQL_COUNT_IMAGES)
         return cursor.fetchone()[0]
-
-
-# Initialize database on module import
-init_db()
@@ -1,20 +1,111 @@
 """
-Image manager for file operations (scanning, moving, copying).
+Image manager for file operations (scanning, moving, copying, thumbnails).
 """
 import os
 import shutil
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict, Any, Optional, Generator
 from datetime import datetime
-from pathlib import Path
 import json
+import uuid
 
-from database import add_image, update_image_path, get_images, add_tags
+from PIL import Image
+
+from database import add_images_bulk, update_image_path, get_images, add_tags, get_file_signatures
 from metadata_parser import parse_image
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 # Supported image extensions
 IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp'}
 
+# Metadata parsing is CPU-bound and independent per file, so larger scans
+# parse in worker processes; below this many files the pool startup costs more
+SCAN_PARALLEL_MIN_FILES = 200
+SCAN_CHUNK_SIZE = 32
+
+
+def _iter_image_entries(root: str, recursive: bool = True) -> Generator[os.DirEntry, None, None]:
+    """Yield a DirEntry for each supported image under root.
+    
+    os.scandir entries carry the file type (and on Windows the stat result)
+    from the directory listing itself, saving per-file stat calls.
+    Directory symlinks are not followed, and unreadable subdirectories
+    are skipped.
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                stack.append(entry.path)
+                        elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                            yield entry
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"Skipping unreadable folder {directory}: {e}")
+
+
+def _metadata_to_json(metadata: Dict[str, Any]) -> str:
+    """Serialize parsed metadata, with orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(metadata).decode()
+        except TypeError:
+            pass  # Fall back to json, which also raises the error callers report
+    return json.dumps(metadata)
+
+
+def _parse_scan_file(image_path: str, mtime: Optional[float] = None) -> Dict[str, Any]:
+    """Parse one file for scan_folder (runs in a worker process).
+    
+    Returns {"image": add_image kwargs} or {"error": message, "traceback": text};
+    errors are returned rather than raised so one bad file doesn't end the map.
+    """
+    try:
+        # Parse metadata
+        metadata = parse_image(image_path)
+        
+        # Get file timestamps (scan_folder passes the mtime from its listing)
+        if mtime is None:
+            mtime = os.stat(image_path).st_mtime
+        created_at = datetime.fromtimestamp(mtime)
+        
+        # Serialize metadata safely
+        try:
+            metadata_json = _metadata_to_json(metadata["metadata"])
+        except (TypeError, ValueError) as e:
+            print(f"Warning: Could not serialize metadata for {image_path}: {e}")
+            metadata_json = "{}"
+        
+        return {"image": dict(
+            path=image_path,
+            filename=os.path.basename(image_path),
+            generator=metadata["generator"],
+            prompt=metadata["prompt"],
+            negative_prompt=metadata["negative_prompt"],
+            metadata_json=metadata_json,
+            width=metadata["width"],
+            height=metadata["height"],
+            file_size=metadata["file_size"],
+            checkpoint=metadata["checkpoint"],
+            loras=metadata["loras"],
+            created_at=created_at
+        )}
+    except Exception as e:
+        return {"error": str(e), "traceback": traceback.format_exc()}
+
 
 def scan_folder(
     folder_path: str,
@@ -34,6 +125,7 @@ def scan_folder(
             "total": int,
             "new": int,
             "updated": int,
+            "unchanged": int,
             "errors": int,
             "by_generator": {generator: count}
         }
@@ -42,72 +134,78 @@ def scan_folder(
         "total": 0,
         "new": 0,
         "updated": 0,
+        "unchanged": 0,
         "errors": 0,
         "by_generator": {}
     }
     
-    # Collect all image files
+    # Collect all image files with their modification times, skipping files
+    # already indexed with the same mtime and size
+    known = get_file_signatures()
     image_files = []
-    folder = Path(folder_path)
+    mtimes = []
+    total = 0
+    for entry in _iter_image_entries(folder_path, recursive):
+        total += 1
+        try:
+            st = entry.stat()
+        except OSError:
+            mtime = None  # Let the parse step report the error
+        else:
+            mtime = st.st_mtime
+            signature = (datetime.fromtimestamp(mtime).isoformat(" "), st.st_size)
+            if known.get(entry.path) == signature:
+                result["unchanged"] += 1
+                continue
+        image_files.append(entry.path)
+        mtimes.append(mtime)
     
-    pattern = "**/*" if recursive else "*"
-    for file_path in folder.glob(pattern):
-        if file_path.is_file() and file_path.suffix.lower() in IMAGE_EXTENSIONS:
-            image_files.append(str(file_path))
+    result["total"] = total
     
-    result["total"] = len(image_files)
+    # Parse each image (in worker processes for large scans); rows are
+    # written in batches as the generator is consumed
+    executor = None
+    if len(image_files) >= SCAN_PARALLEL_MIN_FILES:
+        executor = ProcessPoolExecutor()
+        parsed = executor.map(_parse_scan_file, image_files, mtimes, chunksize=SCAN_CHUNK_SIZE)
+    else:
+        parsed = map(_parse_scan_file, image_files, mtimes)
     
-    # Process each image
-    for i, image_path in enumerate(image_files):
-        try:
+    def parsed_images():
+        for i, (image_path, outcome) in enumerate(zip(image_files, parsed)):
             if progress_callback:
-                progress_callback(i + 1, result["total"], os.path.basename(image_path))
-            
-            # Parse metadata
-            metadata = parse_image(image_path)
+                progress_callback(i + 1, len(image_files), os.path.basename(image_path))
             
-            # Get file timestamps
-            stat = os.stat(image_path)
-            created_at = datetime.fromtimestamp(stat.st_mtime)
-            
-            # Serialize metadata safely
-            try:
-                metadata_json = json.dumps(metadata["metadata"])
-            except (TypeError, ValueError) as e:
-                print(f"Warning: Could not serialize metadata for {image_path}: {e}")
-                metadata_json = "{}"
-            
-            # Add to database
-            add_image(
-                path=image_path,
-                filename=os.path.basename(image_path),
-                generator=metadata["generator"],
-                prompt=metadata["prompt"],
-                negative_prompt=metadata["negative_prompt"],
-                metadata_json=metadata_json,
-                width=metadata["width"],
-                height=metadata["height"],
-                file_size=metadata["file_size"],
-                checkpoint=metadata["checkpoint"],
-                loras=metadata["loras"],
-                created_at=created_at
-            )
+            if "error" in outcome:
+                print(f"Error processing {image_path}: {outcome['error']}")
+                print(outcome["traceback"], end="")
+                result["errors"] += 1
+                continue
             
+            image = outcome["image"]
             result["new"] += 1
             
             # Track by generator
-            gen = metadata["generator"]
+            gen = image["generator"]
             result["by_generator"][gen] = result["by_generator"].get(gen, 0) + 1
-            
-        except Exception as e:
-            print(f"Error processing {image_path}: {e}")
-            import traceback
-            traceback.print_exc()
-            result["errors"] += 1
+            yield image
+    
+    # Add to database
+    try:
+        add_images_bulk(parsed_images())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
     
     return result
 
 
+# Destination paths claimed by moves in progress, so concurrent moves of
+# same-named files into one folder don't pick the same name
+_reserved_paths = set()
+_reserved_paths_lock = threading.Lock()
+
+
 def move_image(image_id: int, destination_folder: str, image_path: str) -> str:
     """
     Move an image to a new folder.
@@ -125,17 +223,32 @@ def move_image(image_id: int, destination_folder: str, image_path: str) -> str:
     filename = os.path.basename(image_path)
     new_path = os.path.join(destination_folder, filename)
     
-    # Handle filename conflicts
-    if os.path.exists(new_path) and new_path != image_path:
-        base, ext = os.path.splitext(filename)
-        counter = 1
-        while os.path.exists(new_path):
-            new_filename = f"{base}_{counter}{ext}"
-            new_path = os.path.join(destination_folder, new_filename)
-            counter += 1
+    # Handle filename conflicts, including paths picked by moves still in
+    # progress on other threads
+    with _reserved_paths_lock:
+        def taken(path):
+            return os.path.exists(path) or os.path.normcase(path) in _reserved_paths
+        
+        if taken(new_path) and new_path != image_path:
+            base, ext = os.path.splitext(filename)
+            counter = 1
+            while taken(new_path):
+                new_filename = f"{base}_{counter}{ext}"
+                new_path = os.path.join(destination_folder, new_filename)
+                counter += 1
+        reserved = os.path.normcase(new_path)
+        _reserved_paths.add(reserved)
     
-    # Move file
-    shutil.move(image_path, new_path)
+    try:
+        # Move file: a plain rename on the same filesystem, falling back to
+        # shutil.move's copy-and-delete when crossing devices (EXDEV)
+        try:
+            os.rename(image_path, new_path)
+        except OSError:
+            shutil.move(image_path, new_path)
+    finally:
+        with _reserved_paths_lock:
+            _reserved_paths.discard(reserved)
     
     # Update database
     update_image_path(image_id, new_path)
@@ -172,6 +285,100 @@ def copy_image(image_path: str, destination_folder: str) -> str:
     return new_path
 
 
+# Thumbnails are cached as JPEGs under THUMBNAIL_DIR, named by image id
+# and size; once the cache passes THUMBNAIL_CACHE_MAX_BYTES the least
+# recently written files are removed (checked every THUMBNAIL_PRUNE_EVERY
+# new thumbnails)
+THUMBNAIL_DIR = os.path.join(os.path.dirname(__file__), "cache", "thumbs")
+THUMBNAIL_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+THUMBNAIL_PRUNE_EVERY = 256
+THUMBNAIL_QUALITY = 82
+
+_thumbnails_since_prune = 0
+_thumbnail_prune_lock = threading.Lock()
+
+
+def get_thumbnail(image_id: int, image_path: str, size: int) -> str:
+    """
+    Get the path of a cached JPEG thumbnail, creating it if needed.
+    
+    Args:
+        image_id: Database ID of the image
+        image_path: Path of the source image
+        size: Maximum width/height in pixels
+    
+    Returns:
+        Path of the thumbnail file
+    """
+    thumb_path = os.path.join(THUMBNAIL_DIR, f"{image_id}_{size}.jpg")
+    try:
+        # Rebuild if the source changed since the thumbnail was written
+        if os.path.getmtime(thumb_path) >= os.path.getmtime(image_path):
+            return thumb_path
+    except OSError:
+        pass
+    
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    with Image.open(image_path) as image:
+        # Lets JPEG decode at a reduced scale instead of full resolution
+        image.draft("RGB", (size, size))
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        
+        # JPEG has no alpha: flatten transparent images onto white
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        
+        # Write under a unique name and rename, so concurrent requests for
+        # the same thumbnail never read a partial file
+        tmp_path = f"{thumb_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            image.save(tmp_path, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+            os.replace(tmp_path, thumb_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    
+    global _thumbnails_since_prune
+    with _thumbnail_prune_lock:
+        _thumbnails_since_prune += 1
+        if _thumbnails_since_prune >= THUMBNAIL_PRUNE_EVERY:
+            _thumbnails_since_prune = 0
+            prune_thumbnail_cache()
+    
+    return thumb_path
+
+
+def prune_thumbnail_cache(max_bytes: int = THUMBNAIL_CACHE_MAX_BYTES):
+    """Delete the oldest thumbnails until the cache fits in max_bytes."""
+    try:
+        entries = [entry for entry in os.scandir(THUMBNAIL_DIR) if entry.is_file()]
+    except OSError:
+        return
+    
+    stats = []
+    for entry in entries:
+        try:
+            st = entry.stat()
+            stats.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            continue
+    
+    total = sum(size for _, size, _ in stats)
+    for _, size, path in sorted(stats):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
 def batch_move(
     image_ids: List[int],
     image_paths: List[str],
@@ -213,20 +420,20 @@ def batch_move(
 
 def get_folder_stats(folder_path: str) -> Dict[str, Any]:
     """Get statistics about a folder's images."""
-    folder = Path(folder_path)
-    
     stats = {
         "total_files": 0,
         "total_size": 0,
         "by_extension": {}
     }
     
-    for file_path in folder.rglob("*"):
-        if file_path.is_file():
-            ext = file_path.suffix.lower()
-            if ext in IMAGE_EXTENSIONS:
-                stats["total_files"] += 1
-                stats["total_size"] += file_path.stat().st_size
-                stats["by_extension"][ext] = stats["by_extension"].get(ext, 0) + 1
+    for entry in _iter_image_entries(folder_path):
+        try:
+            size = entry.stat().st_size
+        except OSError:
+            continue
+        ext = os.path.splitext(entry.name)[1].lower()
+        stats["total_files"] += 1
+        stats["total_size"] += size
+        stats["by_extension"][ext] = stats["by_extension"].get(ext, 0) + 1
     
     return stats
@@ -7,15 +7,18 @@ This is the main application entry point. Endpoints are organized into routers:
 - routers/tags.py - Tag management and tagging
 - routers/sorting.py - Scanning, moving, and manual sorting
 - routers/censor.py - NSFW detection and censoring
+- routers/tasks.py - Background task progress and cancellation
 """
 import os
 import sys
+import queue
+import logging
+import threading
 from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
 
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.middleware.gzip import GZipMiddleware
 
 # Add current dir to path for imports
 sys.path.insert(0, os.path.dirname(__file__))
@@ -23,24 +26,35 @@ sys.path.insert(0, os.path.dirname(__file__))
 import database as db
 
 # Import routers
-from routers import images, tags, sorting, censor
+from routers import images, tags, sorting, censor, tasks
+from utils.static_cache import load_static_files, static_response
+from utils.json_response import FastJSONResponse
 
 
-# Lazy import tagger to avoid loading model at startup
-_tagger = None
-_tagger_settings = {}
+# Responses smaller than this aren't worth gzipping
+GZIP_MINIMUM_SIZE = 512
 
+# Lifecycle messages are queued and written by a listener thread, so the
+# event loop never blocks on stdout
+logger = logging.getLogger("sd_sorter")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_queue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(_log_queue))
+_log_listener = QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
 
+
+# Tagger is imported lazily; the instance itself is cached in tagger.get_tagger()
 def get_tagger(
     model_name: str = None,
     model_path: str = None,
     tags_path: str = None,
     threshold: float = 0.35,
     character_threshold: float = 0.85,
-    use_gpu: bool = True
+    use_gpu: bool = True,
+    precision: str = "fp32"
 ):
     """Get or create the tagger instance with given settings."""
-    global _tagger, _tagger_settings
     from tagger import get_tagger as _get_tagger, DEFAULT_MODEL
     
     model_name = model_name or DEFAULT_MODEL
@@ -51,45 +65,80 @@ def get_tagger(
         tags_path=tags_path,
         threshold=threshold,
         character_threshold=character_threshold,
-        use_gpu=use_gpu
+        use_gpu=use_gpu,
+        precision=precision
     )
 
 
+def _warmup_tagger():
+    """Warm up the default tagger, logging rather than raising on failure."""
+    try:
+        from tagger import warmup_tagger
+        warmup_tagger()
+    except Exception as e:
+        logger.warning(f"Tagger warmup skipped: {e}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application startup and shutdown handler."""
     # Startup
-    print("SD Image Sorter backend starting...")
+    _log_listener.start()
+    logger.info("SD Image Sorter backend starting...")
     db.init_db()
     
+    # Frontend files are served from memory; restart to pick up edits
+    if os.path.exists(frontend_path):
+        frontend_files.update(load_static_files(frontend_path))
+    
     # Initialize the tags router with the tagger getter
     tags.set_tagger_getter(get_tagger)
     
+    # Load the tagger model in the background so the first tagging run
+    # doesn't wait for it
+    threading.Thread(target=_warmup_tagger, daemon=True).start()
+    
     yield
     # Shutdown
-    print("Shutting down...")
+    logger.info("Shutting down...")
+    await tags.stop_predict_batcher()
+    db.close_all_connections()
+    _log_listener.stop()
 
 
+# SD_ENV=prod turns off the interactive docs and the OpenAPI schema, which
+# is otherwise built from every route on first request
+PRODUCTION = os.environ.get("SD_ENV", "").lower() == "prod"
+docs_options = {"docs_url": None, "redoc_url": None, "openapi_url": None} if PRODUCTION else {}
+
 app = FastAPI(
     title="SD Image Sorter",
     description="Image management API for Stable Diffusion generated images",
     version="2.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
+    **docs_options
 )
 
-# CORS for frontend
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# No CORS middleware: the frontend is served from this same origin (/ and
+# /static), so browsers never need cross-origin headers or preflights
+
+# Compress JSON responses. Already-encoded responses (the precompressed
+# frontend files) and image content types are passed through untouched.
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
 
-# Serve frontend static files
+# Frontend static files, loaded into memory at startup (see lifespan)
 frontend_path = os.path.join(os.path.dirname(__file__), "..", "frontend")
-if os.path.exists(frontend_path):
-    app.mount("/static", StaticFiles(directory=frontend_path), name="static")
+frontend_files = {}
+
+
+@app.api_route("/static/{file_path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def serve_static(file_path: str, request: Request):
+    """Serve a frontend file from the in-memory cache."""
+    entry = frontend_files.get(file_path)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return static_response(entry, request)
 
 
 # Include routers
@@ -97,14 +146,15 @@ app.include_router(images.router)
 app.include_router(tags.router)
 app.include_router(sorting.router)
 app.include_router(censor.router)
+app.include_router(tasks.router)
 
 
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Serve the main frontend page."""
-    index_path = os.path.join(frontend_path, "index.html")
-    if os.path.exists(index_path):
-        return FileResponse(index_path)
+    entry = frontend_files.get("index.html")
+    if entry is not None:
+        return static_response(entry, request)
     return {"message": "SD Image Sorter API", "docs": "/docs"}
 
 
@@ -112,4 +162,8 @@ async def root():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    # One worker: scan/tag progress, the tagger model and the frontend cache
+    # live in this process. uvicorn already picks uvloop and httptools when
+    # installed (uvicorn[standard]); the access log would print a line for
+    # every thumbnail the gallery loads.
+    uvicorn.run(app, host="127.0.0.1", port=8000, access_log=False)
@@ -3,12 +3,15 @@ Censor endpoints for SD Image Sorter.
 Handles NSFW detection, censoring preview and save operations.
 """
 import os
+import math
+import asyncio
 import base64
 import traceback
-from typing import Optional, List
+from typing import Optional, List, Tuple, Union
 from io import BytesIO
 
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import Response
 from pydantic import BaseModel
 from PIL import Image, PngImagePlugin
 
@@ -54,19 +57,13 @@ class CensorSaveDataRequest(BaseModel):
     original_image_id: Optional[int] = None
 
 
-# Lazy-loaded detector
-_censor_detector = None
-
-
 @router.post("/detect")
 async def censor_detect(request: CensorDetectRequest):
     """
     Run detection on an image to find regions to censor.
     Returns list of detected regions with class names and confidence.
     """
-    global _censor_detector
-    
-    from censor import CensorDetector
+    from censor import get_detector
     from utils.path_validation import validate_file_path, ALLOWED_MODEL_EXTENSIONS
     
     image = db.get_image_by_id(request.image_id)
@@ -81,17 +78,12 @@ async def censor_detect(request: CensorDetectRequest):
         raise HTTPException(status_code=400, detail=error or f"Invalid model path: {request.model_path}")
     
     try:
-        if _censor_detector is None or _censor_detector.model_path != request.model_path or _censor_detector.session is None:
-            if _censor_detector is not None and _censor_detector.session is None:
-                print("Censor detector exists but session is None, re-loading...")
-            
-            print(f"Loading censor model: {request.model_path}")
-            _censor_detector = CensorDetector(request.model_path)
-            _censor_detector.load()
-            print("Model loaded successfully")
+        detector = get_detector(request.model_path)
         
         print(f"Running detection on: {image['path']}")
-        detections = _censor_detector.detect(image["path"], request.confidence_threshold)
+        detections = detector.detections_to_dicts(
+            detector.detect(image["path"], request.confidence_threshold)
+        )
         print(f"Found {len(detections)} detections")
         
         return {
@@ -110,11 +102,74 @@ async def censor_detect(request: CensorDetectRequest):
         raise HTTPException(status_code=500, detail=f"Detection failed: {msg}")
 
 
-@router.post("/preview")
-async def censor_preview(request: CensorApplyRequest):
-    """Apply censoring and return base64 preview image."""
+# Previews are scaled down to at most this many pixels on each side
+PREVIEW_MAX_SIZE = 1600
+
+
+def _open_rgb(image_path: str, max_size: Optional[int] = None) -> Tuple[Image.Image, float]:
+    """
+    Decode an image as RGB (blocking), returning it with its scale relative
+    to the full-size image.
+    
+    With max_size the result is shrunk by a whole factor to fit max_size
+    (so it ends up between half and all of max_size). JPEGs decode straight
+    to that scale (libjpeg DCT scaling); other formats are box-reduced,
+    which is much cheaper than resampling. An image that is already RGB is
+    used as decoded rather than copied by convert().
+    """
+    with Image.open(image_path) as image:
+        full_width = image.width
+        if max_size:
+            fit = max_size / 2 / max(image.size)
+            image.draft("RGB", (max(1, int(image.width * fit)), max(1, int(image.height * fit))))
+        image.load()
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        factor = math.ceil(max(image.size) / max_size) if max_size else 1
+        if factor > 1:
+            image = image.reduce(factor)
+        return image, image.width / full_width
+
+
+def _do_censor(
+    image: Image.Image,
+    request: Union[CensorApplyRequest, CensorSaveRequest],
+    scale: float = 1.0
+) -> Image.Image:
+    """
+    Apply the requested censoring to image in place (blocking).
+    
+    scale maps the request's full-resolution regions, block size and blur
+    radius onto a scaled-down image.
+    """
     from censor import Censor
     
+    regions = [tuple(round(v * scale) for v in r) for r in request.regions]
+    
+    return Censor.apply_censoring(
+        image,
+        regions,
+        style=request.style,
+        inplace=True,
+        block_size=max(1, round(request.block_size * scale)),
+        # A float sigma: rounding would turn small radii into 0 (no blur)
+        blur_radius=request.blur_radius * scale,
+        sticker_path=request.sticker_path
+    )
+
+
+def _render_preview(image_path: str, request: CensorApplyRequest) -> bytes:
+    """Censor a scaled-down copy of an image and encode it as JPEG (blocking)."""
+    image, scale = _open_rgb(image_path, PREVIEW_MAX_SIZE)
+    
+    buffer = BytesIO()
+    _do_censor(image, request, scale).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+@router.post("/preview")
+async def censor_preview(request: CensorApplyRequest):
+    """Apply censoring and return the preview as a JPEG image."""
     image_data = db.get_image_by_id(request.image_id)
     if not image_data:
         raise HTTPException(status_code=404, detail="Image not found")
@@ -123,35 +178,16 @@ async def censor_preview(request: CensorApplyRequest):
         raise HTTPException(status_code=404, detail="Image file not found on disk")
     
     try:
-        image = Image.open(image_data["path"]).convert('RGB')
-        regions = [tuple(r) for r in request.regions]
-        
-        censored = Censor.apply_censoring(
-            image,
-            regions,
-            style=request.style,
-            block_size=request.block_size,
-            blur_radius=request.blur_radius,
-            sticker_path=request.sticker_path
-        )
-        
-        buffer = BytesIO()
-        censored.save(buffer, format='JPEG', quality=90)
-        buffer.seek(0)
-        b64_image = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        
-        return {
-            "status": "ok",
-            "preview": f"data:image/jpeg;base64,{b64_image}"
-        }
+        jpeg = await asyncio.to_thread(_render_preview, image_data["path"], request)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Preview failed: {str(e)}")
+    
+    return Response(content=jpeg, media_type="image/jpeg", headers={"Cache-Control": "no-store"})
 
 
 @router.post("/save")
 async def censor_save(request: CensorSaveRequest):
     """Apply censoring and save to output folder."""
-    from censor import Censor
     from utils.path_validation import validate_folder_path
     
     image_data = db.get_image_by_id(request.image_id)
@@ -165,38 +201,29 @@ async def censor_save(request: CensorSaveRequest):
     if not is_valid:
         raise HTTPException(status_code=400, detail=error or "Invalid output folder")
     
-    try:
+    base_name = os.path.splitext(image_data["filename"])[0]
+    ext = os.path.splitext(image_data["filename"])[1] or ".png"
+    output_filename = f"{base_name}{request.filename_suffix}{ext}"
+    output_path = os.path.join(request.output_folder, output_filename)
+    
+    def save_censored():
         os.makedirs(request.output_folder, exist_ok=True)
-        
-        image = Image.open(image_data["path"]).convert('RGB')
-        regions = [tuple(r) for r in request.regions]
-        
-        censored = Censor.apply_censoring(
-            image,
-            regions,
-            style=request.style,
-            block_size=request.block_size,
-            blur_radius=request.blur_radius,
-            sticker_path=request.sticker_path
-        )
-        
-        base_name = os.path.splitext(image_data["filename"])[0]
-        ext = os.path.splitext(image_data["filename"])[1] or ".png"
-        output_filename = f"{base_name}{request.filename_suffix}{ext}"
-        output_path = os.path.join(request.output_folder, output_filename)
-        
+        censored = _do_censor(_open_rgb(image_data["path"])[0], request)
         if ext.lower() in ['.jpg', '.jpeg']:
             censored.save(output_path, format='JPEG', quality=95)
         else:
             censored.save(output_path, format='PNG')
-        
-        return {
-            "status": "ok",
-            "output_path": output_path,
-            "filename": output_filename
-        }
+    
+    try:
+        await asyncio.to_thread(save_censored)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Save failed: {str(e)}")
+    
+    return {
+        "status": "ok",
+        "output_path": output_path,
+        "filename": output_filename
+    }
 
 
 @router.post("/save-data")
@@ -212,7 +239,7 @@ async def censor_save_data(request: CensorSaveDataRequest):
     if not is_valid:
         raise HTTPException(status_code=400, detail=error or "Invalid output folder")
     
-    try:
+    def save_image():
         os.makedirs(request.output_folder, exist_ok=True)
         
         if ',' in request.image_data:
@@ -331,5 +358,8 @@ async def censor_save_data(request: CensorSaveDataRequest):
             "output_path": output_path,
             "filename": output_filename
         }
+    
+    try:
+        return await asyncio.to_thread(save_image)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Save failed: {str(e)}")
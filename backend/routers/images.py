@@ -3,15 +3,64 @@ Image endpoints for SD Image Sorter.
 Handles image retrieval, filtering, and file serving.
 """
 import os
+import json
+import base64
+import asyncio
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response
 
 import database as db
+from image_manager import get_thumbnail
+from utils.static_cache import etag_matches
 
 router = APIRouter(prefix="/api", tags=["images"])
 
+# Gallery tiles are up to ~400 CSS pixels wide, so the default leaves room
+# for high-DPI screens; requested sizes are clamped to the min/max
+THUMBNAIL_DEFAULT_SIZE = 512
+THUMBNAIL_MIN_SIZE = 64
+THUMBNAIL_MAX_SIZE = 1024
+
+
+def file_response(path: str, request: Request, media_type: Optional[str] = None) -> Response:
+    """
+    Serve an image file with an ETag from its mtime and size, answering a
+    matching If-None-Match with an empty 304.
+    
+    Image URLs are keyed by image ID, not content, and a file can change in
+    place (re-saved, or a thumbnail rebuilt), so browsers revalidate
+    (no-cache) instead of trusting a max-age; a hit costs no body.
+    """
+    stat = os.stat(path)
+    headers = {
+        "ETag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+        "Cache-Control": "no-cache",
+    }
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
+
+
+def encode_cursor(after: tuple) -> str:
+    """Encode a keyset position (see db.keyset_after) as an opaque URL-safe token."""
+    return base64.urlsafe_b64encode(json.dumps(list(after)).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a token from encode_cursor; raises ValueError if it is malformed."""
+    try:
+        key, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("Malformed cursor")
+    # Sort keys are text, numbers or NULL (bool is an int subclass, so excluded)
+    if isinstance(key, bool) or not isinstance(key, (str, int, float, type(None))):
+        raise ValueError("Malformed cursor")
+    if isinstance(last_id, bool) or not isinstance(last_id, int):
+        raise ValueError("Malformed cursor")
+    return (key, last_id)
+
 
 @router.get("/images")
 async def get_images(
@@ -24,6 +73,7 @@ async def get_images(
     sort_by: str = Query(default="newest", description="Sort by: newest, oldest, name_asc, name_desc, generator, prompt_length, tag_count, rating, character_count, random, file_size"),
     limit: int = Query(default=0, description="0 = no limit, returns all images"),
     offset: int = 0,
+    cursor: Optional[str] = Query(default=None, description="next_cursor from the previous page, instead of offset"),
     min_width: Optional[int] = None,
     max_width: Optional[int] = None,
     min_height: Optional[int] = None,
@@ -39,6 +89,10 @@ async def get_images(
     - search: Search in prompts
     - sort_by: Sorting method
     - limit: 0 for all images
+    - cursor: Continue from a previous page's next_cursor. Pages by keyset,
+      so deep pages cost the same as the first; only the sorts in
+      db.KEYSET_SORTS return a next_cursor. total is only computed for the
+      first page (null on cursor pages).
     - min_width, max_width, min_height, max_height: Dimension filters
     - aspect_ratio: 'square', 'landscape', or 'portrait'
     """
@@ -52,7 +106,18 @@ async def get_images(
     # Use very high limit when 0 (all images)
     actual_limit = limit if limit > 0 else 999999
     
-    images = db.get_images(
+    after = None
+    if cursor:
+        if sort_by not in db.KEYSET_SORTS:
+            raise HTTPException(status_code=400, detail=f"Sort '{sort_by}' does not support cursors")
+        if offset:
+            raise HTTPException(status_code=400, detail="Use either cursor or offset, not both")
+        try:
+            after = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    filters = dict(
         generators=gen_list,
         tags=tag_list,
         ratings=rating_list,
@@ -60,17 +125,41 @@ async def get_images(
         loras=lr_list,
         search_query=search,
         prompt_terms=prompt_list,
-        sort_by=sort_by,
-        limit=actual_limit,
-        offset=offset,
         min_width=min_width,
         max_width=max_width,
         min_height=min_height,
         max_height=max_height,
         aspect_ratio=aspect_ratio
     )
+    images = db.get_images(
+        **filters,
+        sort_by=sort_by,
+        limit=actual_limit,
+        offset=offset,
+        # Counting every match would undo the point of a keyset page
+        with_total=after is None,
+        after=after
+    )
+    
+    # Every row carries the unpaginated match count; report it once
+    total = None
+    if after is None:
+        if images:
+            total = images[0]["total_rows"]
+        elif offset > 0:
+            # A page past the end has no row to carry the count
+            first = db.get_images(**filters, limit=1, with_total=True, fields=["id"])
+            total = first[0]["total_rows"] if first else 0
+        else:
+            total = 0
+        for image in images:
+            del image["total_rows"]
     
-    return {"images": images, "count": len(images)}
+    next_cursor = None
+    if limit > 0 and len(images) == limit and sort_by in db.KEYSET_SORTS:
+        next_cursor = encode_cursor(db.keyset_after(images[-1], sort_by))
+    
+    return {"images": images, "count": len(images), "total": total, "next_cursor": next_cursor}
 
 
 @router.get("/images/{image_id}")
@@ -85,7 +174,7 @@ async def get_image(image_id: int):
 
 
 @router.get("/image-file/{image_id}")
-async def get_image_file(image_id: int):
+async def get_image_file(image_id: int, request: Request):
     """Serve the actual image file."""
     image = db.get_image_by_id(image_id)
     if not image:
@@ -94,12 +183,12 @@ async def get_image_file(image_id: int):
     if not os.path.exists(image["path"]):
         raise HTTPException(status_code=404, detail="Image file not found on disk")
     
-    return FileResponse(image["path"])
+    return file_response(image["path"], request)
 
 
 @router.get("/image-thumbnail/{image_id}")
-async def get_image_thumbnail(image_id: int, size: int = 256):
-    """Get a thumbnail of the image (returns full image for now, frontend can resize)."""
+async def get_image_thumbnail(image_id: int, request: Request, size: int = THUMBNAIL_DEFAULT_SIZE):
+    """Get a JPEG thumbnail of the image, at most size pixels on each side."""
     image = db.get_image_by_id(image_id)
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
@@ -107,4 +196,12 @@ async def get_image_thumbnail(image_id: int, size: int = 256):
     if not os.path.exists(image["path"]):
         raise HTTPException(status_code=404, detail="Image file not found on disk")
     
-    return FileResponse(image["path"])
+    size = min(max(size, THUMBNAIL_MIN_SIZE), THUMBNAIL_MAX_SIZE)
+    try:
+        thumb_path = await asyncio.to_thread(get_thumbnail, image_id, image["path"], size)
+    except Exception as e:
+        # Fall back to the original file if it can't be thumbnailed
+        print(f"Error creating thumbnail for {image['path']}: {e}")
+        return file_response(image["path"], request)
+    
+    return file_response(thumb_path, request, media_type="image/jpeg")
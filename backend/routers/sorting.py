@@ -4,6 +4,7 @@ Handles scanning, moving, batch operations, and manual sort sessions.
 """
 import os
 import json
+import asyncio
 from typing import Optional, List
 
 from fastapi import APIRouter, HTTPException, BackgroundTasks
@@ -11,6 +12,7 @@ from pydantic import BaseModel
 
 import database as db
 from image_manager import scan_folder, move_image
+from tasks import task_manager, TaskConflictError
 
 router = APIRouter(prefix="/api", tags=["sorting"])
 
@@ -52,28 +54,29 @@ class BatchTagExportRequest(BaseModel):
     prefix: Optional[str] = ""
 
 
-# Progress and session state - managed from main module
-scan_progress = {"status": "idle", "current": 0, "total": 0, "message": ""}
+# Moves run in worker threads, this many at a time
+MOVE_CONCURRENCY = 8
+
+
+# Manual sort sessions walk the filtered images in this order
+SORT_SESSION_ORDER = "newest"
+
+# Manual sort session state (scan progress is tracked by tasks.task_manager).
+# Only the filters and a keyset position are kept; the next image is read
+# from the database as the session advances, instead of holding the whole
+# filtered list in memory.
 sort_session = {
     "active": False,
-    "images": [],
+    "filters": {},
+    "after": None,  # keyset position of the last image passed (db.keyset_after)
+    "current": None,  # image being sorted, None once all are done
     "current_index": 0,
+    "total": 0,
     "folders": {},
     "history": []
 }
 
 
-def get_scan_progress_state():
-    """Get the current scan progress."""
-    return scan_progress
-
-
-def set_scan_progress_state(state):
-    """Set the scan progress state."""
-    global scan_progress
-    scan_progress = state
-
-
 def get_sort_session():
     """Get the current sort session."""
     return sort_session
@@ -85,46 +88,67 @@ def set_sort_session(session):
     sort_session = session
 
 
+def _next_sort_image(filters, after):
+    """Get the first image matching filters after a keyset position (None for the start)."""
+    images = db.get_images(sort_by=SORT_SESSION_ORDER, limit=1, after=after, **filters)
+    return images[0] if images else None
+
+
+def _sort_position():
+    """The current image's index, the session total and the images remaining."""
+    return {
+        "index": sort_session["current_index"],
+        "total": sort_session["total"],
+        "remaining": max(0, sort_session["total"] - sort_session["current_index"])
+    }
+
+
 @router.post("/scan")
-async def start_scan(request: ScanRequest, background_tasks: BackgroundTasks):
+async def start_scan(request: ScanRequest):
     """Start scanning a folder for images."""
-    global scan_progress
-    
     from utils.path_validation import validate_folder_path
     
     is_valid, error = validate_folder_path(request.folder_path)
     if not is_valid:
         raise HTTPException(status_code=400, detail=error or "Invalid folder path")
     
-    if scan_progress["status"] == "running":
-        raise HTTPException(status_code=400, detail="Scan already in progress")
-    
-    def run_scan():
-        global scan_progress
-        scan_progress = {"status": "running", "current": 0, "total": 0, "message": "Starting..."}
-        
+    def run_scan(progress):
         def progress_cb(current, total, filename):
-            scan_progress["current"] = current
-            scan_progress["total"] = total
-            scan_progress["message"] = f"Processing: {filename}"
+            task_manager.check_cancelled(progress)
+            progress["current"] = current
+            progress["total"] = total
+            progress["message"] = f"Processing: {filename}"
         
         result = scan_folder(request.folder_path, request.recursive, progress_cb)
-        scan_progress = {
-            "status": "done",
+        return {
             "current": result["total"],
             "total": result["total"],
             "message": f"Completed! {result['new']} images indexed.",
             "result": result
         }
     
-    background_tasks.add_task(run_scan)
-    return {"status": "started", "message": "Scan started in background"}
+    try:
+        task_id = task_manager.submit("scan", run_scan)
+    except TaskConflictError:
+        raise HTTPException(status_code=400, detail="Scan already in progress")
+    return {"status": "started", "task_id": task_id, "message": "Scan started in background"}
 
 
 @router.get("/scan/progress")
 async def get_scan_progress():
-    """Get current scan progress."""
-    return scan_progress
+    """Get the progress of the most recent scan."""
+    return task_manager.latest("scan") or {"status": "idle", "current": 0, "total": 0, "message": ""}
+
+
+async def _run_moves(move_one, items) -> list:
+    """Run move_one over items in worker threads, at most MOVE_CONCURRENCY at once, keeping order."""
+    semaphore = asyncio.Semaphore(MOVE_CONCURRENCY)
+    
+    async def run(item):
+        async with semaphore:
+            return await asyncio.to_thread(move_one, item)
+    
+    return await asyncio.gather(*(run(item) for item in items))
 
 
 @router.post("/move")
@@ -138,18 +162,17 @@ async def move_images(request: MoveRequest):
     
     os.makedirs(request.destination_folder, exist_ok=True)
     
-    results = []
-    for image_id in request.image_ids:
+    def move_one(image_id):
         image = db.get_image_by_id(image_id)
         if image and os.path.exists(image["path"]):
             try:
                 new_path = move_image(image_id, request.destination_folder, image["path"])
-                results.append({"id": image_id, "new_path": new_path, "success": True})
+                return {"id": image_id, "new_path": new_path, "success": True}
             except Exception as e:
-                results.append({"id": image_id, "error": str(e), "success": False})
-        else:
-            results.append({"id": image_id, "error": "Image not found", "success": False})
+                return {"id": image_id, "error": str(e), "success": False}
+        return {"id": image_id, "error": "Image not found", "success": False}
     
+    results = await _run_moves(move_one, request.image_ids)
     return {"results": results}
 
 
@@ -200,16 +223,17 @@ async def batch_move_images(request: BatchMoveRequest, background_tasks: Backgro
     
     os.makedirs(request.destination_folder, exist_ok=True)
     
-    moved = 0
-    errors = []
-    for image in images:
-        if os.path.exists(image["path"]):
-            try:
-                move_image(image["id"], request.destination_folder, image["path"])
-                moved += 1
-            except Exception as e:
-                errors.append(f"Error moving {image['path']}: {e}")
-                print(f"[batch-move] Error moving {image['path']}: {e}")
+    def move_one(image):
+        if not os.path.exists(image["path"]):
+            return False
+        try:
+            move_image(image["id"], request.destination_folder, image["path"])
+            return True
+        except Exception as e:
+            print(f"[batch-move] Error moving {image['path']}: {e}")
+            return False
+    
+    moved = sum(await _run_moves(move_one, images))
     
     print(f"[batch-move] Successfully moved {moved} images")
     return {"message": f"Moved {moved} images", "count": moved}
@@ -243,20 +267,23 @@ async def start_sort_session(
     if rating_list:
         tag_list = (tag_list or []) + rating_list
     
-    images = db.get_images(
-        generators=gen_list,
-        tags=tag_list,
-        ratings=rating_list,
-        checkpoints=cp_list,
-        loras=lr_list,
-        prompt_terms=prompt_list,
-        min_width=min_width,
-        max_width=max_width,
-        min_height=min_height,
-        max_height=max_height,
-        aspect_ratio=aspect_ratio,
-        limit=999999
-    )
+    filters = {
+        "generators": gen_list,
+        "tags": tag_list,
+        "ratings": rating_list,
+        "checkpoints": cp_list,
+        "loras": lr_list,
+        "prompt_terms": prompt_list,
+        "min_width": min_width,
+        "max_width": max_width,
+        "min_height": min_height,
+        "max_height": max_height,
+        "aspect_ratio": aspect_ratio
+    }
+    
+    # Only the first image is read now, along with the match count
+    first = db.get_images(sort_by=SORT_SESSION_ORDER, limit=1, with_total=True, **filters)
+    total = first[0].pop("total_rows") if first else 0
     
     folder_config = {}
     if folders:
@@ -267,16 +294,19 @@ async def start_sort_session(
     
     sort_session = {
         "active": True,
-        "images": images,
+        "filters": filters,
+        "after": None,
+        "current": first[0] if first else None,
         "current_index": 0,
+        "total": total,
         "folders": folder_config,
         "history": []
     }
     
     return {
         "status": "started",
-        "total_images": len(images),
-        "current": images[0] if images else None
+        "total_images": total,
+        "current": sort_session["current"]
     }
 
 
@@ -286,18 +316,16 @@ async def get_current_sort_image():
     if not sort_session["active"]:
         raise HTTPException(status_code=400, detail="No active sort session")
     
-    if sort_session["current_index"] >= len(sort_session["images"]):
+    current = sort_session["current"]
+    if current is None:
         return {"done": True, "message": "All images sorted"}
     
-    current = sort_session["images"][sort_session["current_index"]]
     tags = db.get_image_tags(current["id"])
     
     return {
         "image": current,
         "tags": tags,
-        "index": sort_session["current_index"],
-        "total": len(sort_session["images"]),
-        "remaining": len(sort_session["images"]) - sort_session["current_index"]
+        **_sort_position()
     }
 
 
@@ -319,6 +347,8 @@ async def sort_action(action: str, folder_key: Optional[str] = None):
         if sort_session["history"]:
             last = sort_session["history"].pop()
             print(f"[sort/action] Undoing: {last}")
+            # Step back to where the session was when that image was current
+            sort_session["after"] = last["after"]
             if last["action"] == "move":
                 image = db.get_image_by_id(last["image_id"])
                 if image:
@@ -335,32 +365,25 @@ async def sort_action(action: str, folder_key: Optional[str] = None):
             return {"status": "no_history", "message": "Nothing to undo"}
         
         # Return current image info for the undone position - get FRESH data from DB
-        if sort_session["current_index"] < len(sort_session["images"]):
-            old_image = sort_session["images"][sort_session["current_index"]]
-            # Fetch fresh image data from database to get updated path
-            fresh_image = db.get_image_by_id(old_image["id"])
-            if fresh_image:
-                # Update the session's images array with fresh data
-                sort_session["images"][sort_session["current_index"]] = fresh_image
-                current = fresh_image
-            else:
-                current = old_image
+        current = db.get_image_by_id(last["image_id"])
+        if current is None:
+            # Deleted since: carry on from the next image still there
+            current = _next_sort_image(sort_session["filters"], sort_session["after"])
+        sort_session["current"] = current
+        if current is not None:
             current_tags = db.get_image_tags(current["id"])
             return {
                 "status": "undone",
                 "image": current,
                 "tags": current_tags,
-                "index": sort_session["current_index"],
-                "total": len(sort_session["images"]),
-                "remaining": len(sort_session["images"]) - sort_session["current_index"]
+                **_sort_position()
             }
         return {"status": "undone", "current_index": sort_session["current_index"]}
     
-    if sort_session["current_index"] >= len(sort_session["images"]):
+    current = sort_session["current"]
+    if current is None:
         return {"done": True}
     
-    current = sort_session["images"][sort_session["current_index"]]
-    
     if action == "move" and folder_key:
         folder = sort_session["folders"].get(folder_key)
         print(f"[sort/action] Move to folder: {folder}, image path: {current['path']}")
@@ -372,6 +395,7 @@ async def sort_action(action: str, folder_key: Optional[str] = None):
                 sort_session["history"].append({
                     "action": "move",
                     "image_id": current["id"],
+                    "after": sort_session["after"],
                     "original_path": original_path,
                     "new_path": new_path,
                     "folder_key": folder_key
@@ -384,24 +408,25 @@ async def sort_action(action: str, folder_key: Optional[str] = None):
     elif action == "skip":
         sort_session["history"].append({
             "action": "skip",
-            "image_id": current["id"]
+            "image_id": current["id"],
+            "after": sort_session["after"]
         })
     
     sort_session["current_index"] += 1
     print(f"[sort/action] New index: {sort_session['current_index']}")
     
-    if sort_session["current_index"] >= len(sort_session["images"]):
+    sort_session["after"] = db.keyset_after(current, SORT_SESSION_ORDER)
+    next_image = _next_sort_image(sort_session["filters"], sort_session["after"])
+    sort_session["current"] = next_image
+    if next_image is None:
         return {"done": True, "message": "All images sorted"}
     
-    next_image = sort_session["images"][sort_session["current_index"]]
     next_tags = db.get_image_tags(next_image["id"])
     
     return {
         "image": next_image,
         "tags": next_tags,
-        "index": sort_session["current_index"],
-        "total": len(sort_session["images"]),
-        "remaining": len(sort_session["images"]) - sort_session["current_index"]
+        **_sort_position()
     }
 
 
@@ -427,10 +452,7 @@ async def get_sort_folders():
 @router.delete("/clear-gallery")
 async def clear_gallery():
     """Clear all image records from the database."""
-    with db.get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM images")
-        cursor.execute("DELETE FROM tags")
+    await asyncio.to_thread(db.clear_all_images)
     return {"status": "ok", "message": "Gallery cleared"}
 
 
@@ -451,24 +473,8 @@ async def get_analytics():
         """)
         checkpoints = [dict(row) for row in cursor.fetchall()]
         
-        # Loras - use same extraction logic as the filter for count consistency
-        # Extract from both loras JSON column AND prompt <lora:name:weight> patterns
-        cursor.execute("""
-            SELECT id, loras, prompt 
-            FROM images 
-            WHERE (loras IS NOT NULL AND loras != '[]' AND loras != '')
-               OR (prompt IS NOT NULL AND prompt LIKE '%<lora:%')
-        """)
-        all_loras_rows = cursor.fetchall()
-        lora_counts = {}
-        for row in all_loras_rows:
-            # Use same extraction logic as filter for consistency
-            image_loras = db.extract_lora_names(row["loras"] or "", row["prompt"] or "")
-            for lora_name in image_loras:
-                lora_counts[lora_name] = lora_counts.get(lora_name, 0) + 1
-        
-        sorted_loras = sorted(lora_counts.items(), key=lambda x: x[1], reverse=True)[:50]
-        loras = [{"lora": l, "count": c} for l, c in sorted_loras]
+        # Loras - counted from the same normalized names the filter matches
+        loras = db.get_all_loras()[:50]
         
         tags = db.get_all_tags()[:20]
         
@@ -506,31 +512,37 @@ async def export_tags_batch(request: BatchTagExportRequest):
     
     os.makedirs(request.output_folder, exist_ok=True)
     
-    blacklist = set(tag.strip().lower() for tag in (request.blacklist or []))
+    blacklist = [tag.strip() for tag in (request.blacklist or [])]
     prefix = request.prefix or ""
     
-    exported = 0
-    errors = []
-    
-    for image_id in request.image_ids:
-        image = db.get_image_by_id(image_id)
-        if not image:
-            errors.append(f"Image {image_id} not found")
-            continue
+    def write_all():
+        exported = 0
+        errors = []
         
-        tags = db.get_image_tags(image_id)
-        filtered_tags = [t["tag"] for t in tags if t["tag"].lower() not in blacklist]
-        tag_string = prefix + ", ".join(filtered_tags) if filtered_tags else prefix.rstrip(", ")
-        
-        image_basename = os.path.splitext(image["filename"])[0]
-        output_path = os.path.join(request.output_folder, f"{image_basename}.txt")
+        # One query for every image's tags, with the blacklist applied in SQL
+        tagged = db.get_tags_for_images(request.image_ids, exclude=blacklist)
+        for image_id in request.image_ids:
+            image = tagged.get(image_id)
+            if not image:
+                errors.append(f"Image {image_id} not found")
+                continue
+            
+            filtered_tags = image["tags"]
+            tag_string = prefix + ", ".join(filtered_tags) if filtered_tags else prefix.rstrip(", ")
+            
+            image_basename = os.path.splitext(image["filename"])[0]
+            output_path = os.path.join(request.output_folder, f"{image_basename}.txt")
+            
+            try:
+                with open(output_path, "w", encoding="utf-8") as f:
+                    f.write(tag_string)
+                exported += 1
+            except Exception as e:
+                errors.append(f"Error writing {output_path}: {e}")
         
-        try:
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(tag_string)
-            exported += 1
-        except Exception as e:
-            errors.append(f"Error writing {output_path}: {e}")
+        return exported, errors
+    
+    exported, errors = await asyncio.to_thread(write_all)
     
     return {
         "status": "ok",
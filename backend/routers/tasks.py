@@ -0,0 +1,34 @@
+"""
+Task endpoints for SD Image Sorter.
+Reports progress of background jobs (scans, tagging runs) and cancels them.
+"""
+from fastapi import APIRouter, HTTPException
+
+from tasks import task_manager
+
+router = APIRouter(prefix="/api", tags=["tasks"])
+
+
+@router.get("/tasks")
+async def list_tasks():
+    """Get all tracked background tasks, oldest first."""
+    return {"tasks": task_manager.list()}
+
+
+@router.get("/tasks/{task_id}")
+async def get_task(task_id: str):
+    """Get a background task's progress."""
+    task = task_manager.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return task
+
+
+@router.post("/tasks/{task_id}/cancel")
+async def cancel_task(task_id: str):
+    """Ask a running background task to stop."""
+    if task_manager.get(task_id) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if not task_manager.cancel(task_id):
+        raise HTTPException(status_code=400, detail="Task is not running")
+    return {"status": "cancelling"}
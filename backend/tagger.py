@@ -4,7 +4,10 @@ Supports automatic model download from HuggingFace and local model loading.
 """
 import os
 import json
+import asyncio
+import threading
 import numpy as np
+from concurrent.futures import Executor
 from typing import List, Dict, Any, Optional, Tuple
 from PIL import Image
 from pathlib import Path
@@ -57,6 +60,11 @@ MODELS = {
 # Default to eva02-large for best quality
 DEFAULT_MODEL = "wd-eva02-large-tagger-v3"
 
+# Model precisions: "int8" runs a dynamically quantized copy of the model
+# (weights stored as INT8), made once next to the original file. It is
+# faster on CPU but shifts confidences slightly, so it is opt-in.
+PRECISIONS = ("fp32", "int8")
+
 # Rating categories
 RATINGS = ["general", "sensitive", "questionable", "explicit"]
 
@@ -72,7 +80,8 @@ class WD14Tagger:
         model_dir: Optional[str] = None,
         threshold: float = 0.35,
         character_threshold: float = 0.85,
-        use_gpu: bool = True
+        use_gpu: bool = True,
+        precision: str = "fp32"
     ):
         """
         Initialize the tagger.
@@ -85,7 +94,11 @@ class WD14Tagger:
             threshold: Confidence threshold for general tags
             character_threshold: Confidence threshold for character tags
             use_gpu: Whether to use GPU acceleration (CUDA) if available
+            precision: One of PRECISIONS ("int8" is meant for CPU inference)
         """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}. Available: {list(PRECISIONS)}")
+        
         _ensure_imports()
         
         self.model_name = model_name
@@ -95,6 +108,7 @@ class WD14Tagger:
         self.threshold = threshold
         self.character_threshold = character_threshold
         self.use_gpu = use_gpu
+        self.precision = precision
         
         self.session = None
         self.tags = []
@@ -104,6 +118,7 @@ class WD14Tagger:
         self.rating_indices = {}  # Map rating name to index
         
         self._loaded = False
+        self._load_lock = threading.Lock()
     
     def _get_default_model_dir(self) -> str:
         """Get default model directory - prefers project folder over user cache."""
@@ -231,6 +246,44 @@ class WD14Tagger:
         
         return model_path, tags_path
     
+    def has_local_model(self) -> bool:
+        """Whether the model and tags files are already on disk (no download needed)."""
+        if self.model_path:
+            return os.path.exists(self.model_path)
+        if self.model_name not in MODELS:
+            return False
+        config = MODELS[self.model_name]
+        model_folder = os.path.join(self.model_dir, self.model_name)
+        return (
+            self._validate_model_file(os.path.join(model_folder, config["model_file"]))
+            and os.path.exists(os.path.join(model_folder, config["tags_file"]))
+        )
+    
+    def warmup(self):
+        """Load the model and run one blank inference.
+        
+        The first run on a session pays for provider setup and kernel
+        selection (cuDNN autotuning on CUDA); doing it here keeps that cost
+        off the first real image.
+        """
+        self.load()
+        model_input = self.session.get_inputs()[0]
+        shape = [dim if isinstance(dim, int) else 1 for dim in model_input.shape]
+        self.session.run(None, {model_input.name: np.zeros(shape, dtype=np.float32)})
+    
+    def _quantized_model_path(self, model_path: str) -> str:
+        """Get the INT8 copy of model_path, quantizing it on first use."""
+        int8_path = os.path.splitext(model_path)[0] + ".int8.onnx"
+        if os.path.exists(int8_path) and os.path.getmtime(int8_path) >= os.path.getmtime(model_path):
+            return int8_path
+        
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        print(f"Quantizing {model_path} to INT8 (one-time)...")
+        tmp_path = int8_path + ".tmp"
+        quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, int8_path)
+        return int8_path
+    
     def _load_tags(self, tags_path: str):
         """Load tag labels from CSV.
         
@@ -269,8 +322,16 @@ class WD14Tagger:
         """Load the model and tags."""
         if self._loaded:
             return
-        
+        # The startup warmup may be loading this instance on another thread
+        with self._load_lock:
+            if not self._loaded:
+                self._load()
+    
+    def _load(self):
+        """Load the model and tags (caller holds _load_lock)."""
         model_path, tags_path = self._get_model_paths()
+        if self.precision == "int8":
+            model_path = self._quantized_model_path(model_path)
         
         # Load ONNX model with error handling
         print(f"Loading model from {model_path}...")
@@ -386,20 +447,44 @@ class WD14Tagger:
                 "all_tags": [{"tag": str, "confidence": float}, ...]
             }
         """
+        input_data = self.load_input(image_path)
+        probs = self.predict(input_data)[0]
+        return self.postprocess(probs)
+    
+    def load_input(self, image_path: str) -> np.ndarray:
+        """Open and preprocess an image into a (1, H, W, 3) model input."""
         if not self._loaded:
             self.load()
         
-        # Load and preprocess image
         image = Image.open(image_path)
         input_data = self._preprocess(image)
         image.close()  # Free memory immediately
+        return input_data
+    
+    def predict(self, input_data: np.ndarray) -> np.ndarray:
+        """
+        Run the model on stacked inputs from load_input().
         
-        # Run inference
-        input_name = self.session.get_inputs()[0].name
-        output = self.session.run(None, {input_name: input_data})[0]
+        Returns one row of tag probabilities per input. Models exported with
+        a fixed batch size of 1 are run one input at a time.
+        """
+        if not self._loaded:
+            self.load()
         
-        # Process output
-        probs = output[0]
+        model_input = self.session.get_inputs()[0]
+        if model_input.shape[0] == 1 and len(input_data) > 1:
+            return np.concatenate([self.predict(row[np.newaxis]) for row in input_data])
+        return self.session.run(None, {model_input.name: input_data})[0]
+    
+    def postprocess(
+        self,
+        probs: np.ndarray,
+        threshold: Optional[float] = None,
+        character_threshold: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Turn one image's tag probabilities into the tag() result (thresholds default to the tagger's)."""
+        threshold = self.threshold if threshold is None else threshold
+        character_threshold = self.character_threshold if character_threshold is None else character_threshold
         
         result = {
             "general_tags": [],
@@ -413,7 +498,7 @@ class WD14Tagger:
         for tag_id, tag_name in self.general_tags:
             if tag_id < len(probs):
                 conf = float(probs[tag_id])
-                if conf >= self.threshold:
+                if conf >= threshold:
                     result["general_tags"].append({"tag": tag_name, "confidence": conf})
                     result["all_tags"].append({"tag": tag_name, "confidence": conf})
         
@@ -421,7 +506,7 @@ class WD14Tagger:
         for tag_id, tag_name in self.character_tags:
             if tag_id < len(probs):
                 conf = float(probs[tag_id])
-                if conf >= self.character_threshold:
+                if conf >= character_threshold:
                     result["character_tags"].append({"tag": tag_name, "confidence": conf})
                     result["all_tags"].append({"tag": tag_name, "confidence": conf})
         
@@ -446,32 +531,48 @@ class WD14Tagger:
         
         return result
     
-    def tag_batch(self, image_paths: List[str]) -> List[Dict[str, Any]]:
-        """Tag multiple images with memory management."""
-        import gc
-        results = []
-        for i, path in enumerate(image_paths):
+    def tag_batch(self, image_paths: List[str], executor: Optional[Executor] = None) -> List[Dict[str, Any]]:
+        """
+        Tag multiple images with a single model run.
+        
+        Images are decoded in parallel when an executor is given. An image
+        that fails to load gets an empty result with an "error" key.
+        """
+        def load(path):
             try:
-                results.append(self.tag(path))
+                return self.load_input(path)
             except Exception as e:
-                print(f"Error tagging {path}: {e}")
+                return e
+        
+        if not self._loaded:
+            self.load()
+        
+        inputs = list(executor.map(load, image_paths)) if executor else [load(path) for path in image_paths]
+        loaded = [input_data for input_data in inputs if not isinstance(input_data, Exception)]
+        probs = iter(self.predict(np.concatenate(loaded)) if loaded else [])
+        
+        results = []
+        for path, input_data in zip(image_paths, inputs):
+            if isinstance(input_data, Exception):
+                print(f"Error tagging {path}: {input_data}")
                 results.append({
                     "general_tags": [],
                     "character_tags": [],
                     "rating": "unknown",
                     "rating_confidences": {},
                     "all_tags": [],
-                    "error": str(e)
+                    "error": str(input_data)
                 })
-            # Garbage collect every 10 images to prevent memory buildup
-            if (i + 1) % 10 == 0:
-                gc.collect()
+            else:
+                results.append(self.postprocess(next(probs)))
         return results
 
 
-# Singleton instance
+# Singleton instance; the lock keeps the startup warmup and a tagging run
+# from building two instances at once
 _tagger = None
 _current_settings = {}
+_tagger_lock = threading.Lock()
 
 def get_tagger(
     model_name: str = DEFAULT_MODEL,
@@ -480,6 +581,7 @@ def get_tagger(
     threshold: float = 0.35,
     character_threshold: float = 0.85,
     use_gpu: bool = True,
+    precision: str = "fp32",
     force_reload: bool = False
 ) -> WD14Tagger:
     """Get or create the tagger instance."""
@@ -489,26 +591,44 @@ def get_tagger(
         "model_name": model_name,
         "model_path": model_path,
         "tags_path": tags_path,
-        "use_gpu": use_gpu
+        "use_gpu": use_gpu,
+        "precision": precision
     }
     
-    # Reload if settings changed or forced
-    if force_reload or _tagger is None or new_settings != _current_settings:
-        _tagger = WD14Tagger(
-            model_name=model_name,
-            model_path=model_path,
-            tags_path=tags_path,
-            threshold=threshold,
-            character_threshold=character_threshold,
-            use_gpu=use_gpu
-        )
-        _current_settings = new_settings
-    else:
-        # Just update thresholds
-        _tagger.threshold = threshold
-        _tagger.character_threshold = character_threshold
+    with _tagger_lock:
+        # Reload if settings changed or forced
+        if force_reload or _tagger is None or new_settings != _current_settings:
+            _tagger = WD14Tagger(
+                model_name=model_name,
+                model_path=model_path,
+                tags_path=tags_path,
+                threshold=threshold,
+                character_threshold=character_threshold,
+                use_gpu=use_gpu,
+                precision=precision
+            )
+            _current_settings = new_settings
+        else:
+            # Just update thresholds
+            _tagger.threshold = threshold
+            _tagger.character_threshold = character_threshold
+        
+        return _tagger
+
+
+def warmup_tagger():
+    """Load the default tagger and run a warmup inference, if its model is already downloaded.
     
-    return _tagger
+    Called in the background at startup so the first tagging request doesn't
+    pay for the model load. Never downloads: a missing model is still
+    fetched on first use.
+    """
+    tagger = get_tagger()
+    if not tagger.has_local_model():
+        print("Tagger model not downloaded yet; skipping warmup")
+        return
+    tagger.warmup()
+    print("Tagger warmed up")
 
 
 def get_available_models() -> List[str]:
@@ -519,3 +639,87 @@ def get_available_models() -> List[str]:
 def tag_image(image_path: str, threshold: float = 0.35) -> Dict[str, Any]:
     """Convenience function to tag a single image."""
     return get_tagger(threshold=threshold).tag(image_path)
+
+
+# Micro-batching for /api/tags/predict: concurrent requests are coalesced
+# into one session run of up to PREDICT_MAX_BATCH images, waiting at most
+# PREDICT_MAX_DELAY seconds for a batch to fill
+PREDICT_MAX_BATCH = 16
+PREDICT_MAX_DELAY = 0.005
+
+
+class TagBatcher:
+    """Coalesces concurrent predict() calls into batched model runs."""
+    
+    def __init__(self, max_batch: int = PREDICT_MAX_BATCH, max_delay: float = PREDICT_MAX_DELAY):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = None
+        self._task = None
+    
+    def start(self):
+        """Start the batching task on the running event loop."""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the batching task, cancelling predictions still waiting on it."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Requests still queued would otherwise wait forever
+        while self._queue is not None and not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            future.cancel()
+    
+    async def predict(self, tagger: WD14Tagger, input_data: np.ndarray) -> np.ndarray:
+        """Queue one load_input() result and wait for its row of probabilities."""
+        if self._task is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((tagger, input_data, future))
+        return await future
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        items = []
+        try:
+            while True:
+                items = [await self._queue.get()]
+                deadline = loop.time() + self.max_delay
+                while len(items) < self.max_batch:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        items.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                
+                # Requests may use different tagger instances (model settings)
+                groups = {}
+                for item in items:
+                    groups.setdefault(id(item[0]), []).append(item)
+                
+                for group in groups.values():
+                    tagger = group[0][0]
+                    batch = np.concatenate([input_data for _, input_data, _ in group])
+                    try:
+                        probs = await loop.run_in_executor(None, tagger.predict, batch)
+                    except Exception as e:
+                        for _, _, future in group:
+                            if not future.done():
+                                future.set_exception(e)
+                        continue
+                    for row, (_, _, future) in zip(probs, group):
+                        if not future.done():
+                            future.set_result(row)
+        except asyncio.CancelledError:
+            # Also cancel the batch that was being collected or run
+            for _, _, future in items:
+                future.cancel()
+            raise
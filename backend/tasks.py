@@ -0,0 +1,124 @@
+"""
+Background task tracking for long-running jobs (scanning, tagging).
+Each job runs in its own thread and gets an ID and a progress record;
+starting an exclusive job is an atomic check-and-start.
+"""
+import threading
+import uuid
+from typing import Callable, Dict, Any, Optional, List
+
+
+# Finished tasks kept for GET /api/tasks/{id}; older ones are dropped
+MAX_FINISHED_TASKS = 50
+
+
+class TaskConflictError(Exception):
+    """Raised when an exclusive task of the same kind is already running."""
+
+
+class TaskCancelled(Exception):
+    """Raised inside a task function to stop after a cancel request."""
+
+
+class TaskManager:
+    """Runs job functions in background threads and tracks their progress."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks = {}  # task_id -> progress dict, in submission order
+        self._latest = {}  # kind -> task_id of the most recent task
+        self._cancel_events = {}  # task_id -> threading.Event
+
+    def submit(
+        self,
+        kind: str,
+        func: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]],
+        exclusive: bool = True,
+        message: str = "Starting..."
+    ) -> str:
+        """
+        Start func(progress) in a background thread.
+
+        func updates progress ("current", "total", "message") in place and
+        may return a dict merged into it on completion. It should call
+        check_cancelled(progress) at convenient points.
+
+        Raises:
+            TaskConflictError: exclusive and a task of this kind is running
+        """
+        with self._lock:
+            latest = self._tasks.get(self._latest.get(kind))
+            if exclusive and latest is not None and latest["status"] == "running":
+                raise TaskConflictError(f"A {kind} task is already running")
+
+            task_id = uuid.uuid4().hex
+            progress = {
+                "id": task_id,
+                "kind": kind,
+                "status": "running",
+                "current": 0,
+                "total": 0,
+                "message": message
+            }
+            self._tasks[task_id] = progress
+            self._latest[kind] = task_id
+            self._cancel_events[task_id] = threading.Event()
+            self._prune()
+
+        threading.Thread(target=self._run, args=(func, progress), daemon=True).start()
+        return task_id
+
+    def _run(self, func, progress):
+        try:
+            result = func(progress)
+            progress.update(result or {})
+            progress["status"] = "done"
+        except TaskCancelled:
+            progress["status"] = "cancelled"
+            progress["message"] = f"Cancelled after {progress['current']}/{progress['total']}."
+        except Exception as e:
+            print(f"Task {progress['kind']} {progress['id']} failed: {e}")
+            progress["status"] = "error"
+            progress["message"] = f"Error: {str(e)}"
+        finally:
+            with self._lock:
+                self._cancel_events.pop(progress["id"], None)
+
+    def _prune(self):
+        """Drop the oldest finished tasks beyond MAX_FINISHED_TASKS (caller holds the lock)."""
+        finished = [task_id for task_id, task in self._tasks.items() if task["status"] != "running"]
+        latest = set(self._latest.values())
+        for task_id in finished[:max(0, len(finished) - MAX_FINISHED_TASKS)]:
+            if task_id not in latest:
+                del self._tasks[task_id]
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Get a task's progress record."""
+        return self._tasks.get(task_id)
+
+    def latest(self, kind: str) -> Optional[Dict[str, Any]]:
+        """Get the most recent task of a kind."""
+        return self._tasks.get(self._latest.get(kind))
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Get all tracked tasks, oldest first."""
+        with self._lock:
+            return list(self._tasks.values())
+
+    def cancel(self, task_id: str) -> bool:
+        """Ask a running task to stop. Returns False if it isn't running."""
+        with self._lock:
+            event = self._cancel_events.get(task_id)
+        if event is None:
+            return False
+        event.set()
+        return True
+
+    def check_cancelled(self, progress: Dict[str, Any]):
+        """Raise TaskCancelled if the task owning progress was asked to stop."""
+        event = self._cancel_events.get(progress["id"])
+        if event is not None and event.is_set():
+            raise TaskCancelled()
+
+
+task_manager = TaskManager()
@@ -5,7 +5,9 @@ import unittest
 # Add backend to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from censor import CensorDetector
+from PIL import Image
+
+from censor import CensorDetector, Censor
 
 class TestCensorLoading(unittest.TestCase):
     def setUp(self):
@@ -68,5 +70,35 @@ class TestCensorLoading(unittest.TestCase):
         finally:
             CensorDetector.load = original_load
 
+class TestCensorBlur(unittest.TestCase):
+    def _checkered(self, mode):
+        image = Image.new("RGB", (64, 64), (255, 255, 255))
+        for x in range(0, 64, 2):
+            for y in range(64):
+                image.putpixel((x, y), (0, 0, 0))
+        return image.convert(mode)
+
+    def test_zero_radius_leaves_image_unchanged(self):
+        for mode in ("RGB", "RGBA", "P"):
+            image = self._checkered(mode)
+            result = Censor.apply_censoring(image, [(0, 0, 32, 32)], style="blur", blur_radius=0)
+            self.assertEqual(result.tobytes(), image.tobytes(), mode)
+
+    def test_positive_radius_blurs_only_the_region(self):
+        image = self._checkered("RGB")
+        result = Censor.apply_censoring(image, [(0, 0, 32, 32)], style="blur", blur_radius=2)
+        self.assertNotEqual(result.crop((0, 0, 32, 32)).tobytes(), image.crop((0, 0, 32, 32)).tobytes())
+        self.assertEqual(result.crop((32, 32, 64, 64)).tobytes(), image.crop((32, 32, 64, 64)).tobytes())
+
+    def test_scaled_preview_keeps_small_radius(self):
+        from routers.censor import CensorApplyRequest, _do_censor
+
+        # Scaled to a quarter, radius 2 becomes sigma 0.5, which still blurs
+        # (rounding it would give 0 and skip the blur)
+        image = self._checkered("RGB")
+        request = CensorApplyRequest(image_id=1, regions=[[0, 0, 256, 256]], style="blur", blur_radius=2)
+        result = _do_censor(image.copy(), request, scale=0.25)
+        self.assertNotEqual(result.tobytes(), image.tobytes())
+
 if __name__ == "__main__":
     unittest.main()
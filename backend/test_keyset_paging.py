@@ -0,0 +1,134 @@
+import sys
+import os
+import json
+import base64
+import random
+import tempfile
+import unittest
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient
+
+import database as db
+
+
+def make_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode("utf-8")).decode("ascii")
+
+
+class KeysetTestCase(unittest.TestCase):
+    """Runs against a fresh database file holding tied and NULL sort keys."""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.original_path = db.DATABASE_PATH
+        db.DATABASE_PATH = os.path.join(self.folder.name, "test.db")
+        db.init_db()
+
+        rng = random.Random(7)
+        for i in range(60):
+            image_id = db.add_image(
+                f"/library/{i}.png",
+                rng.choice(["a.png", "b.png", f"{i}.png"]),
+                generator=rng.choice(["comfyui", "webui"]),
+                file_size=rng.choice([None, 100, 200]),
+                created_at=rng.choice([None, "2024-01-01 00:00:00", "2024-02-01 00:00:00"])
+            )
+            if i % 3:
+                db.add_tags(image_id, [{"tag": rng.choice(["general", "explicit"]), "confidence": 0.9}])
+
+    def tearDown(self):
+        db.close_all_connections()
+        db.invalidate_reference_cache()
+        db.DATABASE_PATH = self.original_path
+        self.folder.cleanup()
+
+
+class TestKeysetPaging(KeysetTestCase):
+    def _walk(self, sort_by, page_size, **filters):
+        ids = []
+        after = None
+        while True:
+            page = db.get_images(sort_by=sort_by, limit=page_size, after=after, **filters)
+            ids.extend(image["id"] for image in page)
+            if len(page) < page_size:
+                return ids
+            after = db.keyset_after(page[-1], sort_by)
+
+    def test_traversal_matches_unpaged_order(self):
+        for sort_by in db.KEYSET_SORTS:
+            for filters in ({}, {"generators": ["comfyui"]}):
+                expected = [image["id"] for image in db.get_images(sort_by=sort_by, limit=1000, **filters)]
+                for page_size in (1, 7, 60):
+                    with self.subTest(sort_by=sort_by, filters=filters, page_size=page_size):
+                        self.assertEqual(self._walk(sort_by, page_size, **filters), expected)
+
+    def test_keys_include_ties_and_nulls(self):
+        images = db.get_images(sort_by="newest", limit=1000, fields=["id", "created_at", "file_size"])
+        created = [image["created_at"] for image in images]
+        self.assertIn(None, created)
+        self.assertLess(len(set(created)), len(created))
+        self.assertIn(None, [image["file_size"] for image in images])
+
+    def test_rejects_unsupported_combinations(self):
+        with self.assertRaises(ValueError):
+            db.get_images(sort_by="random", after=("x", 1))
+        with self.assertRaises(ValueError):
+            db.get_images(sort_by="newest", after=("x", 1), offset=5)
+
+
+class TestImagesCursorApi(KeysetTestCase):
+    def setUp(self):
+        super().setUp()
+        import main
+        self.client = TestClient(main.app)
+
+    def test_cursor_pages_cover_all_images(self):
+        expected = [image["id"] for image in self.client.get("/api/images").json()["images"]]
+        ids = []
+        params = {"limit": 9}
+        while True:
+            page = self.client.get("/api/images", params=params).json()
+            ids.extend(image["id"] for image in page["images"])
+            if not page["next_cursor"]:
+                break
+            params["cursor"] = page["next_cursor"]
+        self.assertEqual(ids, expected)
+
+    def test_total_on_offset_pages(self):
+        for params, count, total in [
+            ({"limit": 25, "offset": 50}, 10, 60),
+            ({"limit": 25, "offset": 100}, 0, 60),
+            ({"limit": 25, "offset": 100, "generators": "comfyui"}, 0, len(db.get_images(generators=["comfyui"]))),
+            ({"limit": 25, "generators": "missing"}, 0, 0),
+        ]:
+            with self.subTest(params=params):
+                page = self.client.get("/api/images", params=params).json()
+                self.assertEqual((page["count"], page["total"]), (count, total))
+
+    def test_malformed_cursors_are_rejected(self):
+        cursors = [
+            "not base64!",
+            make_cursor("just a string"),
+            make_cursor([1, 2, 3]),
+            make_cursor(["2024-01-01", "7"]),
+            make_cursor(["2024-01-01", True]),
+            make_cursor([{"a": 1}, 7]),
+            make_cursor([[1], 7]),
+            make_cursor([True, 7]),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                response = self.client.get("/api/images", params={"limit": 5, "cursor": cursor})
+                self.assertEqual(response.status_code, 400)
+
+    def test_cursor_needs_keyset_sort_and_no_offset(self):
+        cursor = make_cursor(["2024-01-01 00:00:00", 7])
+        self.assertEqual(self.client.get("/api/images", params={"sort_by": "random", "cursor": cursor}).status_code, 400)
+        self.assertEqual(self.client.get("/api/images", params={"cursor": cursor, "offset": 3}).status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import sys
+import os
+import json
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import database as db
+
+# Schema of the first release (9c050ab), before any versioned migration
+BASELINE_SCHEMA = """
+    CREATE TABLE images (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        path TEXT UNIQUE NOT NULL,
+        filename TEXT NOT NULL,
+        generator TEXT DEFAULT 'unknown',
+        prompt TEXT,
+        negative_prompt TEXT,
+        metadata_json TEXT,
+        width INTEGER,
+        height INTEGER,
+        file_size INTEGER,
+        checkpoint TEXT,
+        loras TEXT,
+        created_at DATETIME,
+        indexed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        tagged_at DATETIME
+    );
+    CREATE TABLE tags (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        image_id INTEGER NOT NULL,
+        tag TEXT NOT NULL,
+        confidence REAL DEFAULT 1.0,
+        FOREIGN KEY (image_id) REFERENCES images(id) ON DELETE CASCADE
+    );
+    CREATE INDEX idx_tags_tag ON tags(tag);
+    CREATE INDEX idx_tags_image_id ON tags(image_id);
+    CREATE INDEX idx_images_generator ON images(generator);
+    CREATE INDEX idx_images_path ON images(path);
+"""
+
+RATINGS = ["general", "sensitive", "questionable", "explicit"]
+CHARACTER_TAGS = ["1girl", "solo", "long hair", "outdoors", "smile"]
+
+
+def sample_images():
+    """Images with the fields the filters look at, and their tags."""
+    images = []
+    for i in range(40):
+        lora = f"style_lora_{i % 3}"
+        prompt = f"masterpiece, best_quality, ({CHARACTER_TAGS[i % 5]}:1.2), scene {i % 4} <lora:{lora}:0.8>"
+        tags = [{"tag": CHARACTER_TAGS[(i + k) % 5], "confidence": 0.5 + k / 10} for k in range(i % 4)]
+        if i % 5:
+            tags.append({"tag": RATINGS[i % 4], "confidence": 0.9})
+        images.append({
+            "path": f"/library/{i:02d}.png",
+            "filename": f"{i:02d}.png",
+            "generator": ["comfyui", "webui", "novelai"][i % 3],
+            "prompt": prompt if i % 7 else None,
+            "negative_prompt": "lowres",
+            "width": [512, 768, 1024][i % 3],
+            "height": [512, 1024, 768][i % 4 % 3],
+            "file_size": 1000 + i,
+            "checkpoint": f"model_{i % 2}.safetensors",
+            "loras": [f"extra_lora_{i % 2}.safetensors"] if i % 2 else [],
+            "created_at": f"2024-01-{i % 28 + 1:02d} 12:00:00",
+            "tags": tags,
+        })
+    return images
+
+
+class TestBaselineMigration(unittest.TestCase):
+    """A database written by the first release migrates to the current schema."""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.original_path = db.DATABASE_PATH
+        self.images = sample_images()
+
+        # The baseline database, written the way the first release did
+        self.baseline_path = os.path.join(self.folder.name, "baseline.db")
+        conn = sqlite3.connect(self.baseline_path)
+        conn.executescript(BASELINE_SCHEMA)
+        for image in self.images:
+            cursor = conn.execute(
+                """INSERT INTO images (path, filename, generator, prompt, negative_prompt,
+                   width, height, file_size, checkpoint, loras, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (image["path"], image["filename"], image["generator"], image["prompt"],
+                 image["negative_prompt"], image["width"], image["height"], image["file_size"],
+                 image["checkpoint"], json.dumps(image["loras"]), image["created_at"])
+            )
+            if image["tags"]:
+                conn.executemany(
+                    "INSERT INTO tags (image_id, tag, confidence) VALUES (?, ?, ?)",
+                    [(cursor.lastrowid, tag["tag"], tag["confidence"]) for tag in image["tags"]]
+                )
+                conn.execute("UPDATE images SET tagged_at = CURRENT_TIMESTAMP WHERE id = ?", (cursor.lastrowid,))
+        conn.commit()
+        conn.close()
+
+        # The same library indexed by the current code
+        self.fresh_path = os.path.join(self.folder.name, "fresh.db")
+        self._use(self.fresh_path)
+        for image in self.images:
+            image_id = db.add_image(
+                image["path"], image["filename"], generator=image["generator"],
+                prompt=image["prompt"], negative_prompt=image["negative_prompt"],
+                width=image["width"], height=image["height"], file_size=image["file_size"],
+                checkpoint=image["checkpoint"], loras=image["loras"], created_at=image["created_at"]
+            )
+            if image["tags"]:
+                db.add_tags(image_id, image["tags"])
+
+    def tearDown(self):
+        db.close_all_connections()
+        db.invalidate_reference_cache()
+        db.DATABASE_PATH = self.original_path
+        db._schema_initialized_path = None
+        self.folder.cleanup()
+
+    def _use(self, path):
+        """Point the database module at path and (re)run init_db on it."""
+        db.close_all_connections()
+        db.invalidate_reference_cache()
+        db.DATABASE_PATH = path
+        db._schema_initialized_path = None
+        db.init_db()
+
+    def _snapshot(self):
+        """Results of each filter (as paths) plus the counters."""
+        queries = {
+            "all": {},
+            "tags": {"tags": ["1girl"]},
+            "two tags": {"tags": ["solo", "long hair"]},
+            "ratings": {"ratings": ["general", "explicit"]},
+            "loras": {"loras": ["style_lora_1"]},
+            "json loras": {"loras": ["extra_lora_1"]},
+            "prompt terms": {"prompt_terms": ["best quality", "smile"]},
+            "search": {"search_query": "scene 2"},
+            "generators": {"generators": ["webui"]},
+            "checkpoints": {"checkpoints": ["model_1.safetensors"]},
+            "aspect ratio": {"aspect_ratio": "portrait"},
+        }
+        snapshot = {
+            name: [image["path"] for image in db.get_images(sort_by="name_asc", limit=1000, **filters)]
+            for name, filters in queries.items()
+        }
+        for sort_by in ("rating", "tag_count"):
+            snapshot[sort_by] = [image["path"] for image in db.get_images(sort_by=sort_by, limit=1000)]
+        snapshot["image count"] = db.get_image_count()
+        snapshot["untagged count"] = db.get_untagged_count()
+        return snapshot
+
+    def test_migrated_database_matches_fresh_one(self):
+        expected = self._snapshot()
+        self.assertEqual(expected["image count"], len(self.images))
+        self.assertTrue(all(expected[name] for name in ("tags", "ratings", "loras", "json loras", "search")))
+
+        self._use(self.baseline_path)
+        first = self._snapshot()
+        self.assertEqual(first, expected)
+
+        # A second start finds the schema current and leaves it alone
+        self._use(self.baseline_path)
+        self.assertEqual(self._snapshot(), expected)
+
+        with db.read_db() as conn:
+            self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], db.SCHEMA_VERSION)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM images").fetchone()[0], len(self.images))
+
+
+class TestSqliteVersion(unittest.TestCase):
+    def test_old_sqlite_is_refused(self):
+        with mock.patch.object(db.sqlite3, "sqlite_version_info", (3, 31, 1)), \
+                mock.patch.object(db.sqlite3, "sqlite_version", "3.31.1"):
+            with self.assertRaisesRegex(RuntimeError, "3.31.1 is too old"):
+                db.init_db()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import sys
+import os
+import asyncio
+import threading
+import unittest
+
+import numpy as np
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from tagger import TagBatcher
+
+
+class BlockingTagger:
+    """predict() blocks until released, so requests pile up behind it."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def predict(self, batch):
+        self.started.set()
+        self.release.wait(5)
+        return np.zeros((len(batch), 3))
+
+
+class TestTagBatcherStop(unittest.TestCase):
+    def test_stop_cancels_running_and_queued_predictions(self):
+        tagger = BlockingTagger()
+
+        async def scenario():
+            batcher = TagBatcher(max_batch=1, max_delay=0)
+            running = asyncio.ensure_future(batcher.predict(tagger, np.zeros((1, 2))))
+            await asyncio.to_thread(tagger.started.wait, 5)
+            queued = [asyncio.ensure_future(batcher.predict(tagger, np.zeros((1, 2)))) for _ in range(3)]
+            await asyncio.sleep(0)
+
+            await batcher.stop()
+            tagger.release.set()
+            # Every caller gets an answer instead of waiting forever
+            return await asyncio.wait_for(
+                asyncio.gather(running, *queued, return_exceptions=True), timeout=5
+            )
+
+        outcomes = asyncio.run(scenario())
+        self.assertEqual(len(outcomes), 4)
+        for outcome in outcomes:
+            self.assertIsInstance(outcome, asyncio.CancelledError)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import sys
+import os
+import time
+import tempfile
+import unittest
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient
+
+import database as db
+import main
+from routers import tags as tags_router
+from tasks import task_manager
+
+
+class FailingBatchTagger:
+    """Fails every batch run; single images fail only when named bad."""
+
+    def tag_batch(self, image_paths, executor=None):
+        raise RuntimeError("out of memory")
+
+    def tag(self, image_path):
+        if "bad" in os.path.basename(image_path):
+            raise ValueError("cannot identify image file")
+        return {"all_tags": [{"tag": "1girl", "confidence": 0.9}]}
+
+
+class TestTaggingBatchFailure(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.original_path = db.DATABASE_PATH
+        self.original_getter = tags_router._get_tagger
+        db.DATABASE_PATH = os.path.join(self.folder.name, "test.db")
+        db.init_db()
+        tags_router.set_tagger_getter(lambda **kwargs: FailingBatchTagger())
+
+        self.image_ids = {}
+        for name in ("a.png", "bad.png", "c.png", "d.png", "e.png"):
+            path = os.path.join(self.folder.name, name)
+            open(path, "wb").close()
+            self.image_ids[name] = db.add_image(path, name)
+
+    def tearDown(self):
+        tags_router.set_tagger_getter(self.original_getter)
+        db.close_all_connections()
+        db.invalidate_reference_cache()
+        db.DATABASE_PATH = self.original_path
+        self.folder.cleanup()
+
+    def _wait(self, task_id):
+        deadline = time.monotonic() + 10
+        while task_manager.get(task_id)["status"] == "running":
+            self.assertLess(time.monotonic(), deadline, "tagging task did not finish")
+            time.sleep(0.01)
+        return task_manager.get(task_id)
+
+    def test_failed_batch_is_retried_per_image(self):
+        response = TestClient(main.app).post("/api/tag/start", json={"batch_size": 4})
+        self.assertEqual(response.status_code, 200)
+        task = self._wait(response.json()["task_id"])
+
+        self.assertEqual(task["status"], "done")
+        self.assertEqual(task["failed"], 1)
+        self.assertIn("Tagged 4 images, 1 failed", task["message"])
+        for name, image_id in self.image_ids.items():
+            expected = [] if name == "bad.png" else ["1girl"]
+            self.assertEqual([tag["tag"] for tag in db.get_image_tags(image_id)], expected, name)
+
+
+class PredictTagger:
+    """Records which paths reach the model."""
+
+    def __init__(self):
+        self.loaded = []
+
+    def load(self):
+        pass
+
+    def load_input(self, image_path):
+        self.loaded.append(image_path)
+        raise ValueError("cannot identify image file")
+
+
+class TestPredictPathValidation(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.original_getter = tags_router._get_tagger
+        self.tagger = PredictTagger()
+        tags_router.set_tagger_getter(lambda **kwargs: self.tagger)
+
+    def tearDown(self):
+        tags_router.set_tagger_getter(self.original_getter)
+        self.folder.cleanup()
+
+    def test_rejected_paths_are_reported_and_not_decoded(self):
+        text_file = os.path.join(self.folder.name, "notes.txt")
+        image_file = os.path.join(self.folder.name, "a.png")
+        for path in (text_file, image_file):
+            open(path, "wb").close()
+        rejected = [text_file, self.folder.name, os.path.join(self.folder.name, "missing.png"), "a\x00.png", ""]
+
+        response = TestClient(main.app).post("/api/tags/predict", json={"image_paths": rejected + [image_file]})
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result["predictions"], {})
+        self.assertEqual(set(result["errors"]), set(rejected + [image_file]))
+        self.assertIn("not allowed", result["errors"][text_file])
+        # Only the valid image got as far as decoding
+        self.assertEqual(self.tagger.loaded, [image_file])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import sys
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Add backend to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import tasks
+from tasks import TaskManager, TaskConflictError
+
+
+class TestTaskManager(unittest.TestCase):
+    def setUp(self):
+        self.manager = TaskManager()
+        self.release = threading.Event()
+
+    def tearDown(self):
+        # Let any task still blocked on the event finish
+        self.release.set()
+
+    def _wait(self, task_id):
+        deadline = time.monotonic() + 5
+        while self.manager.get(task_id)["status"] == "running":
+            self.assertLess(time.monotonic(), deadline, "task did not finish")
+            time.sleep(0.01)
+        return self.manager.get(task_id)
+
+    def _blocking(self, progress):
+        self.release.wait(5)
+        return {"message": "Done"}
+
+    def test_result_is_merged_on_completion(self):
+        task_id = self.manager.submit("scan", lambda progress: {"current": 3, "total": 3, "message": "Done"})
+        task = self._wait(task_id)
+        self.assertEqual(task["status"], "done")
+        self.assertEqual((task["current"], task["total"], task["message"]), (3, 3, "Done"))
+
+    def test_exclusive_conflict(self):
+        first = self.manager.submit("tag", self._blocking)
+        with self.assertRaises(TaskConflictError):
+            self.manager.submit("tag", self._blocking)
+
+        # Other kinds and non-exclusive tasks still start
+        other = self.manager.submit("scan", self._blocking)
+        shared = self.manager.submit("tag", self._blocking, exclusive=False)
+        self.assertEqual(self.manager.latest("tag")["id"], shared)
+
+        self.release.set()
+        for task_id in (first, other, shared):
+            self.assertEqual(self._wait(task_id)["status"], "done")
+
+        # Once finished, the kind can run again
+        self.assertIsNotNone(self.manager.submit("tag", lambda progress: None))
+
+    def test_cancel(self):
+        started = threading.Event()
+
+        def work(progress):
+            progress["total"] = 10
+            while True:
+                self.manager.check_cancelled(progress)
+                progress["current"] += 1
+                started.set()
+                time.sleep(0.01)
+
+        task_id = self.manager.submit("tag", work)
+        self.assertTrue(started.wait(5))
+        self.assertTrue(self.manager.cancel(task_id))
+        task = self._wait(task_id)
+        self.assertEqual(task["status"], "cancelled")
+        self.assertTrue(task["message"].startswith("Cancelled after "))
+
+        # A finished task can't be cancelled
+        self.assertFalse(self.manager.cancel(task_id))
+        self.assertFalse(self.manager.cancel("unknown"))
+
+    def test_exception_marks_error(self):
+        def work(progress):
+            raise RuntimeError("model file missing")
+
+        with mock.patch("builtins.print"):
+            task = self._wait(self.manager.submit("tag", work))
+        self.assertEqual(task["status"], "error")
+        self.assertEqual(task["message"], "Error: model file missing")
+
+    def test_prune_keeps_latest_of_each_kind(self):
+        with mock.patch.object(tasks, "MAX_FINISHED_TASKS", 3):
+            scan_id = self._wait(self.manager.submit("scan", lambda progress: None))["id"]
+            tag_ids = [self._wait(self.manager.submit("tag", lambda progress: None))["id"] for _ in range(6)]
+            running = self.manager.submit("tag", self._blocking, exclusive=False)
+
+            kept = [task["id"] for task in self.manager.list()]
+            # The oldest finished tasks go, but never the latest scan and tag
+            self.assertIn(scan_id, kept)
+            self.assertIn(running, kept)
+            self.assertNotIn(tag_ids[0], kept)
+            self.assertEqual(len([task_id for task_id in kept if task_id != running]), 4)
+            self.assertEqual(self.manager.latest("scan")["id"], scan_id)
+            self.assertEqual(self.manager.latest("tag")["id"], running)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,22 @@
+"""
+JSON response class for the API.
+Encodes with orjson when it is installed, falling back to the stdlib json
+encoder used by Starlette's JSONResponse.
+"""
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse that renders with orjson (numpy scalars/arrays included) when available."""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
@@ -0,0 +1,97 @@
+"""
+In-memory cache for the frontend files.
+The frontend is a handful of small files shipped with the app, so they are
+read once at startup, with gzip/brotli encodings precomputed, and served
+from memory instead of from disk on every request.
+"""
+import os
+import gzip
+import hashlib
+import mimetypes
+from email.utils import formatdate
+from typing import Dict, Any
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Smaller files aren't worth compressing
+COMPRESS_MIN_SIZE = 1024
+
+
+def _accepted_encodings(request: Request) -> set:
+    """Get the content codings listed in the request's Accept-Encoding."""
+    header = request.headers.get("accept-encoding", "")
+    return {part.split(";")[0].strip().lower() for part in header.split(",")}
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match lists etag (so a 304 will do)."""
+    if_none_match = request.headers.get("if-none-match")
+    return bool(if_none_match) and etag in [tag.strip() for tag in if_none_match.split(",")]
+
+
+def load_static_files(root: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Read every file under root into memory.
+
+    Args:
+        root: Folder to load
+
+    Returns:
+        {relative/path: {"body", "gzip", "br", "etag", "last_modified", "media_type"}}
+        where "gzip"/"br" are None when that encoding is unavailable or not smaller
+    """
+    files = {}
+    for folder, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(folder, filename)
+            with open(path, "rb") as f:
+                body = f.read()
+
+            encoded = {"gzip": None, "br": None}
+            if len(body) >= COMPRESS_MIN_SIZE:
+                encoded["gzip"] = gzip.compress(body, 9)
+                if brotli is not None:
+                    encoded["br"] = brotli.compress(body)
+            for encoding, data in encoded.items():
+                if data is not None and len(data) >= len(body):
+                    encoded[encoding] = None
+
+            relpath = os.path.relpath(path, root).replace(os.sep, "/")
+            files[relpath] = {
+                "body": body,
+                **encoded,
+                "etag": '"' + hashlib.md5(body).hexdigest() + '"',
+                "last_modified": formatdate(os.path.getmtime(path), usegmt=True),
+                "media_type": mimetypes.guess_type(filename)[0] or "application/octet-stream",
+            }
+    return files
+
+
+def static_response(entry: Dict[str, Any], request: Request) -> Response:
+    """Build the response for a cached file, honouring If-None-Match and Accept-Encoding."""
+    headers = {
+        "ETag": entry["etag"],
+        "Last-Modified": entry["last_modified"],
+        "Vary": "Accept-Encoding",
+        # File names aren't content-hashed, so browsers must revalidate
+        # (a cheap 304) rather than reuse a possibly stale copy
+        "Cache-Control": "no-cache",
+    }
+
+    if etag_matches(request, entry["etag"]):
+        return Response(status_code=304, headers=headers)
+
+    accepted = _accepted_encodings(request)
+    for encoding in ("br", "gzip"):
+        if entry[encoding] is not None and encoding in accepted:
+            headers["Content-Encoding"] = encoding
+            return Response(content=entry[encoding], media_type=entry["media_type"], headers=headers)
+
+    return Response(content=entry["body"], media_type=entry["media_type"], headers=headers)
@@ -720,6 +720,11 @@ async function pollScanProgress(retryCount = 0) {
         } else if (progress.status === 'running' || progress.status === 'idle') {
             // If idle, the background task might just be starting, keep polling
             setTimeout(() => pollScanProgress(0), 500);
+        } else {
+            // error or cancelled
+            showToast(progress.message, 'error');
+            $('#scan-progress-container').style.display = 'none';
+            $('#btn-start-scan').disabled = false;
         }
     } catch (error) {
         console.error('Poll error:', error);
@@ -796,7 +801,7 @@ async function pollTagProgress() {
             loadImages();
         } else if (progress.status === 'running') {
             setTimeout(pollTagProgress, 500);
-        } else if (progress.status === 'error') {
+        } else if (progress.status === 'error' || progress.status === 'cancelled') {
             showToast(progress.message, 'error');
             $('#tag-progress-container').style.display = 'none';
             $('#btn-start-tag').disabled = false;